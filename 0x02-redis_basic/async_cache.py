@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+An asyncio variant of exercise.Cache built on
+redis.asyncio, keeping the same key layout
+"""
+import asyncio
+from codec import Codec, RawCodec
+from exercise import (History, _as_int, _as_str, _async_pipeline,
+                      _data_key, _queue_values, _scan_pattern, call_history,
+                      count_calls)
+from itertools import islice
+import itertools
+from keys import KeyStrategy, UUIDKeys
+import redis.asyncio
+from typing import Awaitable, Callable, Iterable, List, Optional, Union
+
+
+async def gather_bounded(aws: Iterable[Awaitable], limit: int) -> list:
+    """
+    Await every awaitable with at most limit
+    in flight, returning the results in order
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        """
+        Await one awaitable once a slot is free
+        """
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(bounded(aw) for aw in aws))
+
+
+def _chunks(items: Iterable, size: int) -> List[list]:
+    """
+    Split items into lists of at most size
+    """
+    items = iter(items)
+    return list(iter(lambda: list(islice(items, size)), []))
+
+
+class AsyncHistory(History):
+    """
+    History read with an asyncio client, iterate
+    it with async for, calls is set by load()
+    """
+
+    def __init__(self, fn: Callable, start: int = 0,
+                 limit: Optional[int] = None, reverse: bool = False,
+                 chunk_size: int = 500,
+                 client: Optional[redis.asyncio.Redis] = None):
+        """
+        Constructor method that only sets up paging,
+        the first round trip happens in load()
+        """
+        client = client or getattr(getattr(fn, "__self__", None),
+                                   "_redis", None)
+        self._setup(fn, client or redis.asyncio.Redis(), start, limit,
+                    reverse, chunk_size)
+        self._loaded = False
+
+    async def load(self) -> "AsyncHistory":
+        """
+        Read the counter and the first page
+        """
+        if self._stream is None:
+            key_type = await self._redis.type(self._key + ":history")
+            self._stream = key_type == b"stream"
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_first(pipe)
+        self._read_first(await pipe.execute())
+        self._loaded = True
+        return self
+
+    async def __aiter__(self):
+        """
+        Yield (input, output) pairs, fetching
+        the next page once this one is used up
+        """
+        if not self._loaded:
+            await self.load()
+        page, self._page = self._page, []
+        while True:
+            for record in self._take(page):
+                yield record
+            if self._done(page):
+                return
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_page(pipe)
+            page = self._read_page(await pipe.execute())
+
+
+async def replay(fn: Callable, start: int = 0, limit: Optional[int] = None,
+                 reverse: bool = False):
+    """
+    Display the history of calls of a particular
+    function without blocking the event loop
+    """
+    history = await AsyncHistory(fn, start, limit, reverse).load()
+    print("{} was called {} times:".format(history.name, history.calls))
+    async for input, output in history:
+        print("{}(*{}) -> {}".format(history.name, input, output))
+
+
+class AsyncCache:
+    """
+    A cache class for asyncio code, every store
+    is a single pipelined round trip
+    """
+
+    def __init__(self, client: Optional[redis.asyncio.Redis] = None,
+                 atomic: bool = False, codec: Optional[Codec] = None,
+                 history: str = "lists",
+                 history_limit: Optional[int] = None,
+                 history_sample: int = 1, concurrency: int = 8,
+                 keys: Optional[KeyStrategy] = None,
+                 namespace: Optional[str] = None):
+        """
+        Constructor method that stores an asyncio Redis
+        client. Unlike Cache it does not flush the database,
+        await flushdb() or clear() for that. concurrency
+        bounds how many chunks store_many and get_many send
+        at once. keys.BlockKeys blocks briefly once per
+        block. namespace prefixes every key as in Cache
+        """
+        if history not in ("lists", "stream"):
+            raise ValueError("history must be 'lists' or 'stream'")
+        self._redis = client or redis.asyncio.Redis()
+        self._atomic = atomic
+        self._codec = codec or RawCodec()
+        self._keys = keys or UUIDKeys()
+        self._history = history
+        self._history_limit = history_limit
+        self._history_sample = history_sample
+        self._history_calls = itertools.count()
+        self._concurrency = concurrency
+        self._namespace = namespace
+        self._index = None  # Eviction and buffered counts are sync only
+        self._counter_buffer = None
+
+    async def flushdb(self) -> None:
+        """
+        Flush the database, as Cache() does
+        """
+        await self._redis.flushdb()
+
+    async def clear(self, batch: int = 1000) -> int:
+        """
+        Remove every key of the namespace with SCAN and
+        UNLINK as Cache.clear does, or flush the database
+        when there is no namespace
+        """
+        if self._namespace is None:
+            await self._redis.flushdb()
+            return 0
+        removed = 0
+        chunk = []
+        async for key in self._redis.scan_iter(
+                match=_scan_pattern(self._namespace), count=batch):
+            chunk.append(key)
+            if len(chunk) == batch:
+                removed += await self._redis.unlink(*chunk)
+                chunk = []
+        if chunk:
+            removed += await self._redis.unlink(*chunk)
+        return removed
+
+    async def aclose(self) -> None:
+        """
+        Close the connections of the client
+        """
+        await self._redis.aclose()
+
+    @count_calls
+    @call_history
+    async def store(self, data: Union[str, bytes, int, float],
+                    ttl: Optional[int] = None) -> Union[str, bytes]:
+        """
+        Method that takes a data argument
+        and returns a key, expiring after
+        ttl seconds when it is given
+        """
+        random_key = _data_key(self, self._keys.new_key())
+        async with _async_pipeline(self) as client:
+            client.set(random_key, self._codec.encode(data), ex=ttl)
+        return random_key
+
+    async def store_many(self,
+                         values: Iterable[Union[str, bytes, int, float]],
+                         ttl: Optional[int] = None,
+                         chunk_size: int = 1000) -> List[Union[str, bytes]]:
+        """
+        Store many values, one pipeline per chunk with
+        chunks sent concurrently, and return their keys
+        in input order. Each item is counted and logged
+        as if store had been called once per value,
+        though chunks may reach the history out of order
+        """
+        async def store_chunk(chunk: list) -> List[Union[str, bytes]]:
+            """
+            Write one chunk in one round trip
+            """
+            pipe = self._redis.pipeline(transaction=self._atomic)
+            keys = _queue_values(self, pipe, chunk, ttl)
+            await pipe.execute()
+            return keys
+
+        results = await gather_bounded(
+            [store_chunk(chunk) for chunk in _chunks(values, chunk_size)],
+            self._concurrency)
+        return [key for keys in results for key in keys]
+
+    async def get(self,
+                  key: str,
+                  fn: Optional[Callable] = None) -> Union[str,
+                                                          bytes,
+                                                          int,
+                                                          float]:
+        """
+        Method that takes a key argument
+        and returns the data in the desired
+        format
+        """
+        data = self._codec.decode(await self._redis.get(key))
+        if fn:
+            data = fn(data)
+        return data
+
+    async def get_many(self,
+                       keys: Iterable[str],
+                       fn: Optional[Callable] = None,
+                       chunk_size: int = 1000) -> List:
+        """
+        Fetch many keys with one MGET per chunk, chunks
+        sent concurrently, and return the values in
+        input order, converted with fn when it is given
+        """
+        results = await gather_bounded(
+            [self._redis.mget(chunk)
+             for chunk in _chunks(keys, chunk_size)],
+            self._concurrency)
+        values = [self._codec.decode(value)
+                  for chunk in results for value in chunk]
+        if fn:
+            values = [fn(value) for value in values]
+        return values
+
+    async def get_str(self, data: str) -> str:
+        """
+        automatically parametrizes AsyncCache.get
+        with the correct conversion function
+        """
+        return _as_str(self._codec.decode(await self._redis.get(data)))
+
+    async def get_int(self, data: str) -> int:
+        """
+        automatically parametrizes AsyncCache.get
+        with the correct conversion function
+        """
+        return _as_int(self._codec.decode(await self._redis.get(data)))
@@ -0,0 +1,999 @@
+#!/usr/bin/env python3
+"""
+Storage backends for Cache: Redis itself, an
+in-process engine with the same semantics for
+tests and single-process tools, and a two-tier
+composite serving repeated reads from memory
+"""
+from functools import partial, wraps
+import heapq
+import re
+import threading
+import time
+import redis
+from pool import get_client
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+
+KeyT = Union[str, bytes]
+
+
+class Backend:
+    """
+    The commands Cache, its decorators and replay
+    send, named and answered as redis-py does:
+    values come back as bytes, missing ones as None
+    """
+
+    def get(self, name: KeyT) -> Optional[bytes]:
+        """
+        GET
+        """
+        raise NotImplementedError
+
+    def mget(self, keys, *args) -> List[Optional[bytes]]:
+        """
+        MGET
+        """
+        raise NotImplementedError
+
+    def set(self, name: KeyT, value, ex=None, px=None,
+            nx: bool = False) -> Optional[bool]:
+        """
+        SET with an optional expiry
+        """
+        raise NotImplementedError
+
+    def mset(self, mapping: dict) -> bool:
+        """
+        MSET
+        """
+        raise NotImplementedError
+
+    def incrby(self, name: KeyT, amount: int = 1) -> int:
+        """
+        INCRBY
+        """
+        raise NotImplementedError
+
+    def incr(self, name: KeyT, amount: int = 1) -> int:
+        """
+        INCR
+        """
+        return self.incrby(name, amount)
+
+    def rpush(self, name: KeyT, *values) -> int:
+        """
+        RPUSH
+        """
+        raise NotImplementedError
+
+    def lrange(self, name: KeyT, start: int, end: int) -> List[bytes]:
+        """
+        LRANGE
+        """
+        raise NotImplementedError
+
+    def ltrim(self, name: KeyT, start: int, end: int) -> bool:
+        """
+        LTRIM
+        """
+        raise NotImplementedError
+
+    def unlink(self, *names: KeyT) -> int:
+        """
+        UNLINK
+        """
+        raise NotImplementedError
+
+    def scan_iter(self, match: Optional[str] = None,
+                  count: Optional[int] = None) -> Iterator[bytes]:
+        """
+        SCAN, iterated over every cursor
+        """
+        raise NotImplementedError
+
+    def flushdb(self) -> bool:
+        """
+        FLUSHDB
+        """
+        raise NotImplementedError
+
+    def pipeline(self, transaction: bool = True):
+        """
+        Return an object queuing these commands
+        until execute() returns their results
+        """
+        raise NotImplementedError
+
+
+class RedisBackend(Backend):
+    """
+    A Redis server, every command and feature of
+    redis-py passes straight through
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None, **kwargs):
+        """
+        Constructor method that takes a client,
+        or a pooled one for the kwargs endpoint
+        """
+        self._client = client or get_client(**kwargs)
+
+    def __getattr__(self, name: str):
+        """
+        Forward anything else to the client
+        """
+        return getattr(self._client, name)
+
+    def get(self, name):
+        """
+        GET
+        """
+        return self._client.get(name)
+
+    def mget(self, keys, *args):
+        """
+        MGET
+        """
+        return self._client.mget(keys, *args)
+
+    def set(self, name, value, ex=None, px=None, nx=False, **kwargs):
+        """
+        SET with an optional expiry
+        """
+        return self._client.set(name, value, ex=ex, px=px, nx=nx, **kwargs)
+
+    def mset(self, mapping):
+        """
+        MSET
+        """
+        return self._client.mset(mapping)
+
+    def incrby(self, name, amount=1):
+        """
+        INCRBY
+        """
+        return self._client.incrby(name, amount)
+
+    def rpush(self, name, *values):
+        """
+        RPUSH
+        """
+        return self._client.rpush(name, *values)
+
+    def lrange(self, name, start, end):
+        """
+        LRANGE
+        """
+        return self._client.lrange(name, start, end)
+
+    def ltrim(self, name, start, end):
+        """
+        LTRIM
+        """
+        return self._client.ltrim(name, start, end)
+
+    def unlink(self, *names):
+        """
+        UNLINK
+        """
+        return self._client.unlink(*names)
+
+    def scan_iter(self, match=None, count=None, **kwargs):
+        """
+        SCAN, iterated over every cursor
+        """
+        return self._client.scan_iter(match=match, count=count, **kwargs)
+
+    def flushdb(self, **kwargs):
+        """
+        FLUSHDB
+        """
+        return self._client.flushdb(**kwargs)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """
+        Return a redis-py pipeline
+        """
+        return self._client.pipeline(transaction, shard_hint)
+
+
+def _encode(value) -> bytes:
+    """
+    Return the bytes redis-py would send for a value
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, bool) or value is None:
+        raise redis.DataError("Invalid input of type: '{}'".format(
+            type(value).__name__))
+    if isinstance(value, (int, float)):
+        return repr(value).encode("ascii")
+    raise redis.DataError("Invalid input of type: '{}'".format(
+        type(value).__name__))
+
+
+def _glob(pattern: KeyT):
+    """
+    Return a regex matching what a Redis glob
+    pattern matches, backslash escapes included
+    """
+    pattern = _encode(pattern)
+    out = b""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i:i + 1]
+        if char == b"\\" and i + 1 < len(pattern):
+            out += re.escape(pattern[i + 1:i + 2])
+            i += 1
+        elif char == b"*":
+            out += b".*"
+        elif char == b"?":
+            out += b"."
+        elif char == b"[":
+            end = pattern.find(b"]", i + 1)
+            if end == -1:
+                out += re.escape(char)
+            else:
+                body = pattern[i + 1:end].replace(b"\\", b"\\\\")
+                if body[:1] == b"^":
+                    body = b"^" + body[1:]
+                out += b"[" + body + b"]"
+                i = end
+        else:
+            out += re.escape(char)
+        i += 1
+    return re.compile(out + b"\\Z", re.DOTALL)
+
+
+def _locked(method: Callable) -> Callable:
+    """
+    Run a MemoryBackend method under its lock,
+    dropping the keys that expired first
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """
+        A wrapper for the locked method
+        """
+        with self._lock:
+            self._expire_due()
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+class MemoryBackend(Backend):
+    """
+    A thread-safe in-process store with the semantics
+    of the Redis strings, lists, hashes and sets Cache
+    uses, including expiry. Past max_keys keys the
+    oldest value written with SET or MSET is dropped,
+    counters, lists, hashes and sets never are.
+    Pipelines run under one lock, so they are atomic
+    like MULTI/EXEC
+    """
+
+    def __init__(self, max_keys: Optional[int] = None):
+        """
+        Constructor method that starts empty
+        """
+        self.max_keys = max_keys
+        self._lock = threading.RLock()
+        self._data: Dict[bytes, object] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._deadlines: List[tuple] = []  # Heap of (deadline, key)
+        self._evictable: Dict[bytes, None] = {}  # SET keys, oldest first
+
+    def _expire_due(self) -> None:
+        """
+        Drop the keys whose deadline passed
+        """
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self._deadlines)
+            if self._expires.get(key) == deadline:
+                self._remove(key)
+
+    def _remove(self, key: bytes) -> bool:
+        """
+        Drop a key, telling whether it existed
+        """
+        self._expires.pop(key, None)
+        self._evictable.pop(key, None)
+        return self._data.pop(key, None) is not None
+
+    def _lookup(self, name: KeyT, kind: type):
+        """
+        Return the value of a key, None if missing,
+        raising WRONGTYPE for another kind of value
+        """
+        value = self._data.get(_encode(name))
+        if value is not None and not isinstance(value, kind):
+            raise redis.ResponseError(WRONGTYPE)
+        return value
+
+    def _put(self, key: bytes, value, evictable: bool = False) -> None:
+        """
+        Store a value, dropping the oldest evictable
+        one other than key beyond max_keys
+        """
+        self._data[key] = value
+        if evictable:
+            self._evictable[key] = None
+        if self.max_keys and len(self._data) > self.max_keys:
+            oldest = next(iter(self._evictable), key)
+            if oldest != key:
+                self._remove(oldest)
+
+    def _set_expiry(self, key: bytes, seconds: float) -> None:
+        """
+        Make a key expire after seconds
+        """
+        deadline = time.monotonic() + seconds
+        self._expires[key] = deadline
+        heapq.heappush(self._deadlines, (deadline, key))
+
+    @_locked
+    def get(self, name):
+        """
+        GET
+        """
+        return self._lookup(name, bytes)
+
+    @_locked
+    def mget(self, keys, *args):
+        """
+        MGET, other kinds of values read as None
+        """
+        names = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        values = [self._data.get(_encode(name)) for name in names + list(args)]
+        return [value if isinstance(value, bytes) else None
+                for value in values]
+
+    @_locked
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False,
+            keepttl=False):
+        """
+        SET with an optional expiry in seconds (ex)
+        or milliseconds (px)
+        """
+        key = _encode(name)
+        if nx and key in self._data or xx and key not in self._data:
+            return None
+        expires = self._expires.get(key) if keepttl else None
+        self._remove(key)
+        self._put(key, _encode(value), evictable=True)
+        if ex is not None:
+            self._set_expiry(key, getattr(ex, "total_seconds", lambda: ex)())
+        elif px is not None:
+            self._set_expiry(key, getattr(px, "total_seconds",
+                                          lambda: px / 1000)())
+        elif expires is not None:
+            self._expires[key] = expires
+            heapq.heappush(self._deadlines, (expires, key))
+        return True
+
+    @_locked
+    def mset(self, mapping):
+        """
+        MSET
+        """
+        for name, value in mapping.items():
+            key = _encode(name)
+            self._remove(key)
+            self._put(key, _encode(value), evictable=True)
+        return True
+
+    @_locked
+    def incrby(self, name, amount=1):
+        """
+        INCRBY, keeping the expiry
+        """
+        value = self._lookup(name, bytes)
+        try:
+            number = int(value or 0) + amount
+        except ValueError:
+            raise redis.ResponseError(
+                "value is not an integer or out of range")
+        key = _encode(name)
+        if key in self._data:
+            self._data[key] = str(number).encode("ascii")
+        else:
+            self._put(key, str(number).encode("ascii"))
+        return number
+
+    @_locked
+    def rpush(self, name, *values):
+        """
+        RPUSH
+        """
+        items = self._lookup(name, list)
+        if items is None:
+            items = []
+            self._put(_encode(name), items)
+        items.extend(_encode(value) for value in values)
+        return len(items)
+
+    @_locked
+    def lpush(self, name, *values):
+        """
+        LPUSH
+        """
+        items = self._lookup(name, list)
+        if items is None:
+            items = []
+            self._put(_encode(name), items)
+        items[:0] = [_encode(value) for value in reversed(values)]
+        return len(items)
+
+    @staticmethod
+    def _range(length: int, start: int, end: int) -> slice:
+        """
+        Return the slice of the inclusive, possibly
+        negative Redis indexes start and end
+        """
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end += length
+        return slice(start, max(min(end, length - 1) + 1, start))
+
+    @_locked
+    def lrange(self, name, start, end):
+        """
+        LRANGE
+        """
+        items = self._lookup(name, list) or []
+        return list(items[self._range(len(items), start, end)])
+
+    @_locked
+    def ltrim(self, name, start, end):
+        """
+        LTRIM, an emptied list is removed
+        """
+        items = self._lookup(name, list)
+        if items is not None:
+            items[:] = items[self._range(len(items), start, end)]
+            if not items:
+                self._remove(_encode(name))
+        return True
+
+    @_locked
+    def llen(self, name):
+        """
+        LLEN
+        """
+        return len(self._lookup(name, list) or [])
+
+    @_locked
+    def hset(self, name, key=None, value=None, mapping=None, items=None):
+        """
+        HSET, returning the number of new fields
+        """
+        fields = self._lookup(name, dict)
+        if fields is None:
+            fields = {}
+            self._put(_encode(name), fields)
+        pairs = list((mapping or {}).items())
+        if key is not None:
+            pairs.append((key, value))
+        if items:
+            pairs.extend(zip(items[::2], items[1::2]))
+        added = 0
+        for field, data in pairs:
+            field = _encode(field)
+            added += field not in fields
+            fields[field] = _encode(data)
+        return added
+
+    @_locked
+    def hget(self, name, key):
+        """
+        HGET
+        """
+        return (self._lookup(name, dict) or {}).get(_encode(key))
+
+    @_locked
+    def hmget(self, name, keys, *args):
+        """
+        HMGET
+        """
+        fields = self._lookup(name, dict) or {}
+        keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        return [fields.get(_encode(key)) for key in keys + list(args)]
+
+    @_locked
+    def hgetall(self, name):
+        """
+        HGETALL
+        """
+        return dict(self._lookup(name, dict) or {})
+
+    @_locked
+    def hincrby(self, name, key, amount=1):
+        """
+        HINCRBY
+        """
+        fields = self._lookup(name, dict)
+        if fields is None:
+            fields = {}
+            self._put(_encode(name), fields)
+        field = _encode(key)
+        try:
+            number = int(fields.get(field, 0)) + amount
+        except ValueError:
+            raise redis.ResponseError("hash value is not an integer")
+        fields[field] = str(number).encode("ascii")
+        return number
+
+    @_locked
+    def hdel(self, name, *keys):
+        """
+        HDEL, an emptied hash is removed
+        """
+        fields = self._lookup(name, dict)
+        if fields is None:
+            return 0
+        removed = sum(fields.pop(_encode(key), None) is not None
+                      for key in keys)
+        if not fields:
+            self._remove(_encode(name))
+        return removed
+
+    @_locked
+    def sadd(self, name, *values):
+        """
+        SADD, returning the number of new members
+        """
+        members = self._lookup(name, set)
+        if members is None:
+            members = set()
+            self._put(_encode(name), members)
+        before = len(members)
+        members.update(_encode(value) for value in values)
+        return len(members) - before
+
+    @_locked
+    def srem(self, name, *values):
+        """
+        SREM, an emptied set is removed
+        """
+        members = self._lookup(name, set)
+        if members is None:
+            return 0
+        before = len(members)
+        members.difference_update(_encode(value) for value in values)
+        if not members:
+            self._remove(_encode(name))
+        return before - len(members)
+
+    @_locked
+    def smembers(self, name):
+        """
+        SMEMBERS
+        """
+        return set(self._lookup(name, set) or ())
+
+    @_locked
+    def unlink(self, *names):
+        """
+        UNLINK
+        """
+        return sum(self._remove(_encode(name)) for name in names)
+
+    delete = unlink
+
+    @_locked
+    def exists(self, *names):
+        """
+        EXISTS
+        """
+        return sum(_encode(name) in self._data for name in names)
+
+    @_locked
+    def expire(self, name, time):
+        """
+        EXPIRE
+        """
+        key = _encode(name)
+        if key not in self._data:
+            return False
+        self._set_expiry(key, getattr(time, "total_seconds", lambda: time)())
+        return True
+
+    @_locked
+    def pttl(self, name):
+        """
+        PTTL, -2 for a missing key, -1 without expiry
+        """
+        key = _encode(name)
+        if key not in self._data:
+            return -2
+        if key not in self._expires:
+            return -1
+        return max(int((self._expires[key] - time.monotonic()) * 1000), 0)
+
+    def ttl(self, name):
+        """
+        TTL, -2 for a missing key, -1 without expiry
+        """
+        pttl = self.pttl(name)
+        return pttl if pttl < 0 else (pttl + 500) // 1000
+
+    @_locked
+    def type(self, name):
+        """
+        TYPE
+        """
+        value = self._data.get(_encode(name))
+        if value is None:
+            return b"none"
+        return {bytes: b"string", list: b"list", dict: b"hash",
+                set: b"set"}[type(value)]
+
+    @_locked
+    def rename(self, src, dst):
+        """
+        RENAME, keeping the expiry
+        """
+        source, target = _encode(src), _encode(dst)
+        if source not in self._data:
+            raise redis.ResponseError("no such key")
+        expires = self._expires.get(source)
+        value = self._data[source]
+        evictable = source in self._evictable
+        self._remove(source)
+        self._remove(target)
+        self._put(target, value, evictable)
+        if expires is not None:
+            self._expires[target] = expires
+            heapq.heappush(self._deadlines, (expires, target))
+        return True
+
+    @_locked
+    def dbsize(self):
+        """
+        DBSIZE
+        """
+        return len(self._data)
+
+    @_locked
+    def flushdb(self, asynchronous=False):
+        """
+        FLUSHDB
+        """
+        self._data.clear()
+        self._expires.clear()
+        self._evictable.clear()
+        self._deadlines.clear()
+        return True
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        """
+        SCAN, over a snapshot of the keys
+        """
+        with self._lock:
+            self._expire_due()
+            keys = list(self._data)
+        pattern = _glob(match) if match is not None else None
+        for key in keys:
+            if pattern is None or pattern.match(key):
+                yield key
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """
+        Return a pipeline running its commands under the lock
+        """
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """
+    Queue MemoryBackend commands and run them together
+    """
+
+    def __init__(self, backend: MemoryBackend):
+        """
+        Constructor method that starts with no commands
+        """
+        self._backend = backend
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        """
+        Return a function queuing the named command
+        """
+        method = getattr(self._backend, name)
+
+        def queue(*args, **kwargs):
+            """
+            Queue one command, pipelines chain
+            """
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def __len__(self) -> int:
+        """
+        Return the number of queued commands
+        """
+        return len(self._commands)
+
+    def __enter__(self):
+        """
+        Use the pipeline in a with block
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Drop whatever was not executed
+        """
+        self.reset()
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Run the queued commands atomically and return
+        their results, raising the first error after
+        running all of them as Redis does
+        """
+        commands, self._commands = self._commands, []
+        results = []
+        with self._backend._lock:
+            for number, (method, args, kwargs) in enumerate(commands, 1):
+                try:
+                    results.append(method(*args, **kwargs))
+                except redis.ResponseError as error:
+                    # Numbered like redis-py's pipeline errors
+                    command = " ".join([method.__name__.upper()] + [
+                        arg.decode("utf-8", "replace")
+                        if isinstance(arg, bytes) else str(arg)
+                        for arg in args])
+                    error.args = ("Command # {} ({}) of pipeline caused "
+                                  "error: {}".format(number, command,
+                                                     error.args[0]),)
+                    results.append(error)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, redis.ResponseError):
+                    raise result
+        return results
+
+    def reset(self) -> None:
+        """
+        Drop the queued commands
+        """
+        self._commands = []
+
+
+class TieredBackend(Backend):
+    """
+    A MemoryBackend in front of a slower backend:
+    reads fill the near tier, writes go through to
+    both. Entries read from the far tier are kept for
+    near_ttl seconds, which bounds how stale a value
+    written by another process can be
+    """
+
+    def __init__(self, far: Optional[Backend] = None,
+                 near: Optional[MemoryBackend] = None,
+                 near_ttl: float = 60.0):
+        """
+        Constructor method that takes both tiers,
+        Redis and a 100k-key memory tier by default
+        """
+        self.far = far or RedisBackend()
+        self.near = near or MemoryBackend(max_keys=100000)
+        self.near_ttl = near_ttl
+
+    def _forward(self, name: str, *args, **kwargs):
+        """
+        Run a command on the far tier, dropping
+        the near copy of the key it names
+        """
+        if args and isinstance(args[0], (str, bytes)):
+            self.near.unlink(args[0])
+        return getattr(self.far, name)(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        """
+        Send any other command to the far tier
+        """
+        getattr(self.far, name)  # AttributeError for unknown commands
+        return partial(self._forward, name)
+
+    def incrby(self, name, amount=1):
+        """
+        INCRBY on the far tier
+        """
+        return self._forward("incrby", name, amount)
+
+    def rpush(self, name, *values):
+        """
+        RPUSH on the far tier
+        """
+        return self._forward("rpush", name, *values)
+
+    def lrange(self, name, start, end):
+        """
+        LRANGE on the far tier
+        """
+        return self.far.lrange(name, start, end)
+
+    def ltrim(self, name, start, end):
+        """
+        LTRIM on the far tier
+        """
+        return self._forward("ltrim", name, start, end)
+
+    def scan_iter(self, match=None, count=None, **kwargs):
+        """
+        SCAN the far tier, which holds every key
+        """
+        return self.far.scan_iter(match=match, count=count, **kwargs)
+
+    def _keep(self, name, value, ex=None, px=None) -> None:
+        """
+        Copy a value into the near tier
+        """
+        seconds = self.near_ttl
+        if ex is not None:
+            seconds = min(seconds, getattr(ex, "total_seconds",
+                                           lambda: ex)())
+        elif px is not None:
+            seconds = min(seconds, getattr(px, "total_seconds",
+                                           lambda: px / 1000)())
+        self.near.set(name, value, ex=seconds)
+
+    def get(self, name):
+        """
+        GET from the near tier, then the far one
+        """
+        value = self.near.get(name)
+        if value is None:
+            value = self.far.get(name)
+            if value is not None:
+                self._keep(name, value)
+        return value
+
+    def mget(self, keys, *args):
+        """
+        MGET, asking the far tier for the misses only
+        """
+        names = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        names += list(args)
+        values = self.near.mget(names)
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            fetched = self.far.mget([names[i] for i in missing])
+            for i, value in zip(missing, fetched):
+                if value is not None:
+                    self._keep(names[i], value)
+                values[i] = value
+        return values
+
+    def set(self, name, value, ex=None, px=None, nx=False, **kwargs):
+        """
+        SET in both tiers
+        """
+        result = self.far.set(name, value, ex=ex, px=px, nx=nx, **kwargs)
+        if result:
+            self._keep(name, value, ex, px)
+        elif not nx:
+            self.near.unlink(name)
+        return result
+
+    def mset(self, mapping):
+        """
+        MSET in both tiers
+        """
+        result = self.far.mset(mapping)
+        for name, value in mapping.items():
+            self._keep(name, value)
+        return result
+
+    def unlink(self, *names):
+        """
+        UNLINK from both tiers
+        """
+        self.near.unlink(*names)
+        return self.far.unlink(*names)
+
+    def flushdb(self, **kwargs):
+        """
+        FLUSHDB in both tiers
+        """
+        self.near.flushdb()
+        return self.far.flushdb(**kwargs)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """
+        Return a far-tier pipeline that updates
+        the near tier once it has run
+        """
+        return TieredPipeline(self, self.far.pipeline(transaction))
+
+
+class TieredPipeline:
+    """
+    A far-tier pipeline applying its writes
+    to the near tier after executing
+    """
+
+    def __init__(self, backend: TieredBackend, pipe):
+        """
+        Constructor method that wraps a far pipeline
+        """
+        self._backend = backend
+        self._pipe = pipe
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        """
+        Return a function queuing the named command
+        """
+        command = getattr(self._pipe, name)
+
+        def queue(*args, **kwargs):
+            """
+            Queue one command, pipelines chain
+            """
+            command(*args, **kwargs)
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def __len__(self) -> int:
+        """
+        Return the number of queued commands
+        """
+        return len(self._commands)
+
+    def __enter__(self):
+        """
+        Use the pipeline in a with block
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Drop whatever was not executed
+        """
+        self.reset()
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Run the commands on the far tier, then
+        bring the near tier up to date
+        """
+        commands, self._commands = self._commands, []
+        results = self._pipe.execute(raise_on_error=raise_on_error)
+        near = self._backend.near
+        for (name, args, kwargs), result in zip(commands, results):
+            if name == "set" and result is True:
+                self._backend._keep(args[0], args[1], kwargs.get("ex"),
+                                    kwargs.get("px"))
+            elif name == "mset":
+                for key, value in args[0].items():
+                    self._backend._keep(key, value)
+            elif args and isinstance(args[0], (str, bytes)):
+                near.unlink(args[0])
+        return results
+
+    def reset(self) -> None:
+        """
+        Drop the queued commands
+        """
+        self._commands = []
+        self._pipe.reset()
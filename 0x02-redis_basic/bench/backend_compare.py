@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Run the same Cache workload against the Redis,
+in-memory and tiered backends
+Usage: ./bench/backend_compare.py [N]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+exercise = __import__('exercise')
+backends = __import__('backends')
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+values = ["value-{}".format(i) for i in range(n)]
+
+
+def workload(cache) -> dict:
+    """
+    Time stores, two reads of every key,
+    a batched read and a history replay
+    """
+    timings = {}
+    start = time.perf_counter()
+    keys = [cache.store(value) for value in values]
+    timings["store"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(2):
+        for key in keys:
+            cache.get(key)
+    timings["get x2"] = time.perf_counter() - start
+    start = time.perf_counter()
+    assert cache.get_many(keys, fn=lambda d: d.decode("utf-8")) == values
+    timings["get_many"] = time.perf_counter() - start
+    start = time.perf_counter()
+    assert sum(1 for _ in exercise.History(cache.store)) == n
+    timings["replay"] = time.perf_counter() - start
+    return timings
+
+
+for name, backend in (("redis", backends.RedisBackend()),
+                      ("memory", backends.MemoryBackend()),
+                      ("tiered", backends.TieredBackend())):
+    cache = exercise.Cache(backend=backend, namespace="bench")
+    cache.clear()
+    timings = workload(cache)
+    cache.clear()
+    print("{:7} ".format(name) + "  ".join(
+        "{}: {:.0f} ops/s".format(step, n * (2 if step == "get x2" else 1) /
+                                  seconds)
+        for step, seconds in timings.items()))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Compare the Redis memory per stored value of plain
+keys against hash buckets, for small ints and
+short strings and with uuid4 or BlockKeys keys
+Usage: ./bench/bucket_memory.py [N]
+"""
+import sys
+import os
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Cache = __import__('exercise').Cache
+keys = __import__('keys')
+get_client = __import__('pool').get_client
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+client = get_client()
+values = {
+    "small int": list(range(n)),
+    "12-char str": ["value-{:06d}".format(i % 10 ** 6) for i in range(n)],
+}
+
+print("{:<12} {:<10} {:>14} {:>14} {:>8}".format(
+    "values", "keys", "plain B/item", "bucket B/item", "saved"))
+for name, items in values.items():
+    for key_name in ("uuid4", "block"):
+        per_item = []
+        for buckets in (None, max(n // 100, 1)):
+            client.flushdb()
+            strategy = keys.BlockKeys(client, block=10000) \
+                if key_name == "block" else keys.UUIDKeys()
+            # Keep history and counters out of the measurement
+            cache = Cache(keys=strategy, buckets=buckets, history_sample=n)
+            before = client.info("memory")["used_memory"]
+            cache.store_many(items, chunk_size=5000)
+            after = client.info("memory")["used_memory"]
+            per_item.append((after - before) / n)
+        print("{:<12} {:<10} {:>14.1f} {:>14.1f} {:>7.0%}".format(
+            name, key_name, per_item[0], per_item[1],
+            1 - per_item[1] / per_item[0]))
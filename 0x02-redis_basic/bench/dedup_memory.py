@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Compare plain and deduplicated stores of values
+that repeat: memory per stored value, throughput,
+and the share of time spent hashing
+Usage: ./bench/dedup_memory.py [N] [DISTINCT] [SIZE]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Cache = __import__('exercise').Cache
+Dedup = __import__('dedup').Dedup
+get_client = __import__('pool').get_client
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+payloads = [os.urandom(size) for _ in range(distinct)]
+values = [payloads[i % distinct] for i in range(n)]
+client = get_client()
+
+print("{:<7} {:>12} {:>10}".format("mode", "B/value", "stores/s"))
+for dedup in (False, True):
+    cache = Cache(dedup=dedup, history_sample=n)
+    before = client.info("memory")["used_memory"]
+    start = time.perf_counter()
+    for value in values:
+        cache.store(value)
+    seconds = time.perf_counter() - start
+    after = client.info("memory")["used_memory"]
+    print("{:<7} {:>12.1f} {:>10.0f}".format(
+        "dedup" if dedup else "plain", (after - before) / n, n / seconds))
+
+hasher = Dedup(client, "bench")
+start = time.perf_counter()
+for value in values:
+    hasher.digest(value)
+print("BLAKE2 per {}-byte value: {:.1f}us".format(
+    size, (time.perf_counter() - start) / n * 1e6))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Measure Cache throughput and latency over value
+sizes, threads or processes and pipeline depths,
+printing JSON that can be compared between commits
+Usage: ./bench/harness.py [--server spawn|fakeredis|host:port]
+       [--ops N] [--sizes 16,1024] [--threads 1,8]
+       [--processes 4] [--depths 1,100] [--workloads store,get]
+       [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+exercise = __import__('exercise')
+histogram = __import__('histogram')
+pool = __import__('pool')
+
+WORKLOADS = ("store", "get", "get_int", "decorators", "replay")
+QUANTILES = (50, 90, 99, 99.9)
+
+# The case being run, set before forking the worker processes
+_case = {}
+
+
+class Probe:
+    """
+    An object with a method that only runs the
+    decorators, to measure what they cost
+    """
+
+    def __init__(self):
+        """
+        Constructor method that takes a pooled client
+        """
+        self._redis = pool.get_client()
+        self._namespace = "bench"
+
+    @exercise.count_calls
+    @exercise.call_history
+    def noop(self, value):
+        """
+        Do nothing
+        """
+        return value
+
+
+def spawn_server(binary: str):
+    """
+    Start a throwaway redis-server on a free port
+    and return the process and the port
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL)
+    client = pool.get_client(port=port)
+    for _ in range(100):
+        try:
+            client.ping()
+            return process, port
+        except Exception:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("redis-server did not start")
+
+
+def batches(items: list, depth: int) -> list:
+    """
+    Split items into lists of depth items
+    """
+    return [items[i:i + depth] for i in range(0, len(items), depth)]
+
+
+def run_slice(items: list) -> dict:
+    """
+    Run the current case over some items, returning
+    the latency counts of every batch
+    """
+    workload, depth = _case["workload"], _case["depth"]
+    cache, probe = _case["cache"], _case["probe"]
+    latencies = histogram.Histogram()
+    for batch in batches(items, depth):
+        start = time.perf_counter()
+        if workload == "store":
+            if depth == 1:
+                cache.store(batch[0])
+            else:
+                cache.store_many(batch, chunk_size=depth)
+        elif workload == "get":
+            if depth == 1:
+                cache.get(batch[0])
+            else:
+                cache.get_many(batch, chunk_size=depth)
+        elif workload == "get_int":
+            if depth == 1:
+                cache.get_int(batch[0])
+            else:
+                cache.get_many(batch, int, chunk_size=depth)
+        elif workload == "decorators":
+            for value in batch:
+                probe.noop(value)
+        elif workload == "replay":
+            # One page of depth history entries
+            for _ in exercise.History(cache.store, start=batch[0],
+                                      limit=len(batch), chunk_size=depth):
+                pass
+        latencies.record(time.perf_counter() - start)
+    return latencies.counts
+
+
+def run_case(workload: str, size: int, mode: str, workers: int,
+             depth: int, ops: int) -> dict:
+    """
+    Prepare the data of a case, run it on workers
+    threads or processes and summarize it
+    """
+    cache = exercise.Cache(namespace="bench")
+    cache.clear()
+    value = b"x" * size
+    if workload == "store":
+        items = [value] * ops
+    elif workload == "get":
+        items = cache.store_many([value] * ops, chunk_size=1000)
+    elif workload == "get_int":
+        items = cache.store_many(range(ops), chunk_size=1000)
+    elif workload == "replay":
+        cache.store_many([value] * ops, chunk_size=1000)
+        items = list(range(ops))  # History positions
+    else:
+        items = [value] * ops
+    _case.update(workload=workload, depth=depth, cache=cache,
+                 probe=Probe())
+    slices = [items[i::workers] for i in range(workers)]
+
+    start = time.perf_counter()
+    if mode == "processes":
+        with multiprocessing.get_context("fork").Pool(workers) as procs:
+            results = procs.map(run_slice, slices)
+    else:
+        with ThreadPoolExecutor(workers) as threads:
+            results = list(threads.map(run_slice, slices))
+    seconds = time.perf_counter() - start
+
+    latencies = histogram.Histogram()
+    for counts in results:
+        latencies.merge(histogram.Histogram(counts))
+    cache.clear()
+    return {
+        "workload": workload,
+        "value_size": size,
+        "concurrency": mode,
+        "workers": workers,
+        "depth": depth,
+        "ops": len(items),
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(len(items) / seconds, 1),
+        "batch_latency_us": {
+            "p{}".format(q).replace(".", ""):
+            round(latencies.percentile(q) * 1e6, 1) for q in QUANTILES},
+    }
+
+
+def ints(text: str) -> list:
+    """
+    Parse a comma separated list of ints
+    """
+    return [int(part) for part in text.split(",") if part]
+
+
+def main() -> None:
+    """
+    Run every combination of the options
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--server", default="spawn",
+                        help="spawn, fakeredis or host:port")
+    parser.add_argument("--redis-server", default="redis-server",
+                        help="binary used by --server spawn")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--sizes", type=ints, default=[16, 1024, 16384])
+    parser.add_argument("--threads", type=ints, default=[1, 8])
+    parser.add_argument("--processes", type=ints, default=[])
+    parser.add_argument("--depths", type=ints, default=[1, 100])
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--output", help="file to write, default stdout")
+    args = parser.parse_args()
+
+    process = None
+    if args.server == "spawn":
+        binary = shutil.which(args.redis_server)
+        if binary is None:
+            sys.exit("{} not found, use --server fakeredis".format(
+                args.redis_server))
+        process, port = spawn_server(binary)
+        pool.configure(port=port)
+    elif args.server == "fakeredis":
+        import fakeredis
+        if args.processes:
+            sys.exit("fakeredis lives in one process, drop --processes")
+        pool.configure(connection_class=fakeredis.FakeRedisConnection,
+                       server=fakeredis.FakeServer())
+    else:
+        host, _, port = args.server.rpartition(":")
+        pool.configure(host=host or "localhost", port=int(port))
+
+    concurrency = [("threads", n) for n in args.threads] + \
+        [("processes", n) for n in args.processes]
+    results = []
+    try:
+        for workload in args.workloads.split(","):
+            if workload not in WORKLOADS:
+                sys.exit("unknown workload {}".format(workload))
+            # Only store and get move the values themselves
+            sizes = args.sizes if workload in ("store", "get") \
+                else args.sizes[:1]
+            depths = [1] if workload == "decorators" else args.depths
+            for size in sizes:
+                for mode, workers in concurrency:
+                    for depth in depths:
+                        results.append(run_case(workload, size, mode,
+                                                workers, depth, args.ops))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        "commit": commit,
+        "server": args.server,
+        "python": platform.python_version(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
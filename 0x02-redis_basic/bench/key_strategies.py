@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Compare the key strategies of keys.py: how fast
+they generate keys and how much Redis memory a
+stored value costs with each of them
+Usage: ./bench/key_strategies.py [N]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Cache = __import__('exercise').Cache
+keys = __import__('keys')
+get_client = __import__('pool').get_client
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+client = get_client()
+strategies = {
+    "uuid4 text": keys.UUIDKeys(),
+    "uuid4 bytes": keys.BinaryUUIDKeys(),
+    "snowflake": keys.SnowflakeKeys(client=client),
+    "block INCR": keys.BlockKeys(client, block=10000),
+}
+
+print("{:<12} {:>12} {:>10} {:>14}".format(
+    "strategy", "keys/s", "key bytes", "memory/value"))
+for name, strategy in strategies.items():
+    start = time.perf_counter()
+    for _ in range(n):
+        strategy.new_key()
+    rate = n / (time.perf_counter() - start)
+
+    cache = Cache(keys=strategy)
+    client.flushdb()
+    before = client.info("memory")["used_memory"]
+    stored = cache.store_many((1 for _ in range(n)), chunk_size=5000)
+    after = client.info("memory")["used_memory"]
+    key_bytes = sum(len(key) for key in stored[:1000]) / min(n, 1000)
+
+    print("{:<12} {:>12.0f} {:>10.1f} {:>13.1f}B".format(
+        name, rate, key_bytes, (after - before) / n))
+client.flushdb()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Show how evenly the ring spreads keys, how many
+move when a node is added, and the store_many and
+get_many throughput of a ShardedCache
+Usage: ./bench/sharded_cache.py host:port [host:port ...]
+Start local nodes with: redis-server --port 7001 --daemonize yes
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sharding = __import__('sharding')
+
+nodes = sys.argv[1:] or ["localhost:7001", "localhost:7002",
+                         "localhost:7003"]
+n = 100000
+keys = ["key-{}".format(i) for i in range(n)]
+
+ring = sharding.HashRing(nodes)
+owners = [ring.node_for(key) for key in keys]
+for node in nodes:
+    print("{}: {:.1%} of keys".format(node, owners.count(node) / n))
+ring.add("new:0")
+moved = sum(owner != ring.node_for(key) for owner, key in zip(owners, keys))
+print("adding a node moved {:.1%} of keys (ideal {:.1%})".format(
+    moved / n, 1 / (len(nodes) + 1)))
+
+values = ["value-{}".format(i) for i in range(n)]
+cache = sharding.ShardedCache(nodes)
+start = time.perf_counter()
+stored = cache.store_many(values)
+write = time.perf_counter() - start
+start = time.perf_counter()
+assert cache.get_many(stored, fn=lambda d: d.decode("utf-8")) == values
+read = time.perf_counter() - start
+cache.close()
+print("store_many: {:.0f} ops/s".format(n / write))
+print("get_many:   {:.0f} ops/s".format(n / read))
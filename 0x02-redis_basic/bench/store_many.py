@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Benchmark N single Cache.store calls
+against one Cache.store_many call
+Usage: ./bench/store_many.py [N]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Cache = __import__('exercise').Cache
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+values = ["value-{}".format(i) for i in range(n)]
+
+cache = Cache()
+start = time.perf_counter()
+for value in values:
+    cache.store(value)
+single = time.perf_counter() - start
+
+cache = Cache()
+start = time.perf_counter()
+keys = cache.store_many(values)
+batch = time.perf_counter() - start
+
+assert cache.get_many(keys, fn=lambda d: d.decode("utf-8")) == values
+print("{} x store:     {:.3f}s ({:.0f} ops/s)".format(n, single, n / single))
+print("1 x store_many: {:.3f}s ({:.0f} ops/s)".format(batch, n / batch))
+print("speedup:        {:.1f}x".format(single / batch))
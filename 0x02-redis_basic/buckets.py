@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Pack the small values of a Cache namespace into
+the fields of a fixed number of hashes, which
+Redis keeps in its compact listpack encoding
+"""
+import warnings
+import zlib
+import redis
+from typing import Dict, List, Optional, Sequence, Union
+
+# Listpack limits of Redis 7 when CONFIG GET is not allowed
+MAX_ENTRIES = 128
+MAX_VALUE = 64
+
+# KEYS: bucket, the keys to pack
+# ARGV: the most fields of a compact hash, the values
+# Keys past a full bucket get their own key, returns how many did
+PACK_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local spilled = 0
+for i = 2, #KEYS do
+    if redis.call('HLEN', KEYS[1]) < limit or
+            redis.call('HEXISTS', KEYS[1], KEYS[i]) == 1 then
+        redis.call('HSET', KEYS[1], KEYS[i], ARGV[i])
+    else
+        redis.call('SET', KEYS[i], ARGV[i])
+        spilled = spilled + 1
+    end
+end
+return spilled
+"""
+
+
+def compact_limits(client: redis.Redis) -> tuple:
+    """
+    Return the most fields and the longest field or
+    value a hash can have and stay compact, read from
+    hash-max-listpack-* or, before 7.0, ziplist
+    """
+    try:
+        config = client.config_get("hash-max-*")
+    except redis.ResponseError:  # CONFIG renamed or disabled
+        return MAX_ENTRIES, MAX_VALUE
+    limits = {name.rpartition("-")[2]: int(value)
+              for name, value in config.items()}
+    return (limits.get("entries", MAX_ENTRIES),
+            limits.get("value", MAX_VALUE))
+
+
+def _as_bytes(key) -> bytes:
+    """
+    Normalize a key the way Redis stores it
+    """
+    return key.encode("utf-8") if isinstance(key, str) else bytes(key)
+
+
+class Buckets:
+    """
+    Map every key to a field of one of count hashes.
+    Only keys and values up to max_value bytes belong
+    in a bucket, and the keys of a full bucket are
+    stored plainly, so no hash ever passes the
+    server's hash-max-listpack-value or -entries and
+    switches to a hashtable. count should keep
+    buckets below the entries limit, past it new
+    values spill to plain keys
+    """
+
+    def __init__(self, client: redis.Redis, namespace: str,
+                 count: int = 1024, max_value: int = 64):
+        """
+        Constructor method that names the hashes and
+        reads the limits of compact hashes, lowering
+        max_value to the server's with a warning
+        """
+        self.prefix = namespace + ":bucket:"
+        self.count = count
+        self.max_entries, limit = compact_limits(client)
+        if max_value > limit:
+            warnings.warn("hash-max-listpack-value is {}, bucket values "
+                          "are capped to it".format(limit), RuntimeWarning)
+        self.max_value = min(max_value, limit)
+        self._encoder = client.connection_pool.get_encoder()
+        self._pack = client.register_script(PACK_SCRIPT)
+
+    def bucket(self, key: Union[str, bytes]) -> str:
+        """
+        Return the hash holding a key
+        """
+        return self.prefix + str(zlib.crc32(_as_bytes(key)) % self.count)
+
+    def fits(self, key, data) -> bool:
+        """
+        Tell whether a key and its encoded value are
+        small enough
+        """
+        return len(_as_bytes(key)) <= self.max_value and \
+            len(self._encoder.encode(data)) <= self.max_value
+
+    def set_many(self, client, mapping: Dict) -> None:
+        """
+        Queue one packing script per bucket for keys and
+        values, those of full buckets get their own key.
+        client may be a pipeline
+        """
+        groups: Dict[str, dict] = {}
+        for key, data in mapping.items():
+            groups.setdefault(self.bucket(key), {})[key] = data
+        for bucket, fields in groups.items():
+            self._pack(keys=[bucket, *fields],
+                       args=[self.max_entries, *fields.values()],
+                       client=client)
+
+    def get(self, client: redis.Redis, key) -> Optional[bytes]:
+        """
+        Return the value of a key from its bucket or,
+        for large values, its own key, in one round trip
+        """
+        pipe = client.pipeline(transaction=False)
+        pipe.hget(self.bucket(key), key)
+        pipe.get(key)
+        packed, plain = pipe.execute()
+        return packed if packed is not None else plain
+
+    def get_many(self, client: redis.Redis,
+                 keys: Sequence) -> List[Optional[bytes]]:
+        """
+        Return the values of keys with one HMGET per
+        bucket and one MGET, in a single round trip
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.bucket(key), []).append(i)
+        pipe = client.pipeline(transaction=False)
+        pipe.mget(keys)
+        for bucket, group in groups.items():
+            pipe.hmget(bucket, [keys[i] for i in group])
+        results = pipe.execute()
+        values = results[0]
+        for group, packed in zip(groups.values(), results[1:]):
+            for i, value in zip(group, packed):
+                if value is not None:
+                    values[i] = value
+        return values
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Value codecs for Cache: the raw codec keeps
+today's behaviour, the tagged codec prefixes a
+1-byte type tag so get returns the stored type,
+and the compressing codec wraps either one
+"""
+import json
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # Containers fall back to JSON without msgpack
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Type tags of the tagged codec
+NONE = b"\x00"
+BYTES = b"\x01"
+STR = b"\x02"
+INT = b"\x03"
+FLOAT32 = b"\x04"
+FLOAT64 = b"\x05"
+TRUE = b"\x06"
+FALSE = b"\x07"
+MSGPACK = b"\x08"
+FLOAT_TEXT = b"\x09"
+JSON = b"\x0a"
+
+_DIGITS = b"-0123456789"
+_INT64 = (-2 ** 63, 2 ** 63 - 1)
+_float32 = struct.Struct(">f")
+_float64 = struct.Struct(">d")
+
+
+def _jsonable(value: Any) -> bool:
+    """
+    Tell whether JSON keeps a container as it is,
+    but for tuples coming back as lists
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(_jsonable(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _jsonable(item)
+                   for key, item in value.items())
+    return False
+
+
+class Codec:
+    """
+    Turns values into the bytes stored in Redis and back
+    """
+
+    def encode(self, value: Any) -> Any:
+        """
+        Return what to send to Redis for a value
+        """
+        raise NotImplementedError
+
+    def decode(self, data: Optional[bytes]) -> Any:
+        """
+        Return the value for what Redis returned
+        """
+        raise NotImplementedError
+
+
+class RawCodec(Codec):
+    """
+    Leave values to redis-py, get returns bytes
+    """
+
+    def encode(self, value: Any) -> Any:
+        """
+        Return the value unchanged
+        """
+        return value
+
+    def decode(self, data: Optional[bytes]) -> Optional[bytes]:
+        """
+        Return the bytes unchanged
+        """
+        return data
+
+
+class TaggedCodec(Codec):
+    """
+    Write a type tag followed by a compact payload:
+    floats as the shortest of their repr and 4 or 8
+    packed bytes, str as UTF-8, bytes as is, lists,
+    tuples or dicts as msgpack, or as JSON without it
+    when they only hold str keys and scalars, and ints
+    beyond 64 bits as big-endian two's complement.
+    Ints within 64 bits stay untagged decimal, which
+    Redis keeps in its 8-byte integer encoding
+    """
+
+    def encode(self, value: Any) -> bytes:
+        """
+        Return the tagged bytes of a value
+        """
+        if value is None:
+            return NONE
+        if value is True:
+            return TRUE
+        if value is False:
+            return FALSE
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return BYTES + bytes(value)
+        if isinstance(value, str):
+            return STR + value.encode("utf-8")
+        if isinstance(value, int):
+            if _INT64[0] <= value <= _INT64[1]:
+                return str(value).encode("ascii")
+            length = (value.bit_length() + 8) // 8
+            return INT + value.to_bytes(length, "big", signed=True)
+        if isinstance(value, float):
+            text = FLOAT_TEXT + repr(value).encode("ascii")
+            packed = FLOAT64 + _float64.pack(value)
+            try:
+                if _float32.unpack(_float32.pack(value))[0] == value:
+                    packed = FLOAT32 + _float32.pack(value)
+            except OverflowError:
+                pass
+            return min(text, packed, key=len)
+        if msgpack is not None and isinstance(value, (list, tuple, dict)):
+            return MSGPACK + msgpack.packb(value, use_bin_type=True)
+        if isinstance(value, (list, tuple, dict)) and _jsonable(value):
+            return JSON + json.dumps(value,
+                                     separators=(",", ":")).encode("utf-8")
+        raise TypeError("cannot encode {}".format(type(value).__name__))
+
+    def decode(self, data: Optional[bytes]) -> Any:
+        """
+        Return the value of tagged bytes, None for a
+        missing key, and untagged bytes unchanged
+        """
+        if data is None:
+            return None
+        tag, payload = data[:1], data[1:]
+        if tag and tag in _DIGITS:
+            return int(data)
+        if tag == BYTES:
+            return payload
+        if tag == STR:
+            return payload.decode("utf-8")
+        if tag == INT:
+            return int.from_bytes(payload, "big", signed=True)
+        if tag == FLOAT32:
+            return _float32.unpack(payload)[0]
+        if tag == FLOAT64:
+            return _float64.unpack(payload)[0]
+        if tag == FLOAT_TEXT:
+            return float(payload)
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == MSGPACK and msgpack is not None:
+            return msgpack.unpackb(payload, raw=False)
+        if tag == JSON:
+            return json.loads(payload)
+        # Not written by this codec
+        return data
+
+
+# Header of compressed values: marker, compressor id, payload
+COMPRESSED = b"\x1f"
+STORED = 0  # Compressor id of an escaped uncompressed value
+
+# Compressor id -> (name, compress, decompress)
+_compressors: Dict[int, tuple] = {}
+_compressor_ids: Dict[str, int] = {}
+
+
+def register_compressor(name: str, compressor_id: int,
+                        compress: Callable[[bytes], bytes],
+                        decompress: Callable[[bytes], bytes]) -> None:
+    """
+    Make a compressor available to CompressingCodec,
+    the id is written in every value it compresses
+    """
+    if not 0 < compressor_id < 256:
+        raise ValueError("compressor_id must be between 1 and 255")
+    _compressors[compressor_id] = (name, compress, decompress)
+    _compressor_ids[name] = compressor_id
+
+
+register_compressor("zlib", 1, lambda data: zlib.compress(data, 6),
+                    zlib.decompress)
+if lz4 is not None:
+    register_compressor("lz4", 2, lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    register_compressor("zstd", 3, zstandard.ZstdCompressor().compress,
+                        zstandard.ZstdDecompressor().decompress)
+
+
+class CompressionStats:
+    """
+    Counters a namespace uses to tune its threshold
+    """
+
+    def __init__(self):
+        """
+        Constructor method that zeroes the counters
+        """
+        self._lock = threading.Lock()
+        self.values = 0  # Values at or above the threshold
+        self.compressed = 0  # Of which were stored compressed
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self.decompressed = 0
+        self.decompress_seconds = 0.0
+
+    def add_compress(self, size_in: int, size_out: int,
+                     seconds: float, kept: bool) -> None:
+        """
+        Record one compression attempt
+        """
+        with self._lock:
+            self.values += 1
+            self.compressed += kept
+            self.bytes_in += size_in
+            self.bytes_out += size_out if kept else size_in
+            self.compress_seconds += seconds
+
+    def add_decompress(self, seconds: float) -> None:
+        """
+        Record one decompression
+        """
+        with self._lock:
+            self.decompressed += 1
+            self.decompress_seconds += seconds
+
+    def as_dict(self) -> dict:
+        """
+        Return the counters and the compression ratio
+        """
+        with self._lock:
+            return {
+                "values": self.values,
+                "compressed": self.compressed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": self.bytes_in / self.bytes_out
+                if self.bytes_out else 1.0,
+                "compress_seconds": self.compress_seconds,
+                "decompressed": self.decompressed,
+                "decompress_seconds": self.decompress_seconds,
+            }
+
+
+_stats: Dict[str, CompressionStats] = {}
+_stats_lock = threading.Lock()
+
+
+def compression_stats(namespace: str) -> CompressionStats:
+    """
+    Return the process-wide counters of a namespace
+    """
+    with _stats_lock:
+        return _stats.setdefault(namespace, CompressionStats())
+
+
+def _to_bytes(value: Any) -> bytes:
+    """
+    Return the bytes redis-py would send for a value
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return repr(value).encode("ascii")
+
+
+class CompressingCodec(Codec):
+    """
+    Compress what an inner codec produces once it
+    reaches threshold bytes, marking it with a 2-byte
+    header that decode strips transparently. Values
+    that do not shrink are stored uncompressed
+    """
+
+    def __init__(self, inner: Optional[Codec] = None,
+                 threshold: int = 1024, compressor: str = "zlib",
+                 namespace: str = "Cache"):
+        """
+        Constructor method that picks the compressor
+        and the namespace the counters belong to
+        """
+        if compressor not in _compressor_ids:
+            raise ValueError("unknown compressor {!r}".format(compressor))
+        self.inner = inner or RawCodec()
+        self.threshold = threshold
+        self.compressor_id = _compressor_ids[compressor]
+        self.stats = compression_stats(namespace)
+
+    def encode(self, value: Any) -> Any:
+        """
+        Return the inner encoding, compressed when it is large
+        """
+        data = _to_bytes(self.inner.encode(value))
+        if len(data) >= self.threshold:
+            _, compress, _ = _compressors[self.compressor_id]
+            start = time.thread_time()
+            packed = compress(data)
+            kept = len(packed) + 2 < len(data)
+            self.stats.add_compress(len(data), len(packed) + 2,
+                                    time.thread_time() - start, kept)
+            if kept:
+                return COMPRESSED + bytes((self.compressor_id,)) + packed
+        if data[:1] == COMPRESSED:
+            # Escape a plain value that happens to start like a header
+            return COMPRESSED + bytes((STORED,)) + data
+        return data
+
+    def decode(self, data: Optional[bytes]) -> Any:
+        """
+        Return the inner decoding of data, decompressing it first
+        """
+        if data is not None and data[:1] == COMPRESSED:
+            compressor_id = data[1]
+            data = memoryview(data)[2:]
+            if compressor_id == STORED:
+                data = bytes(data)
+            else:
+                _, _, decompress = _compressors[compressor_id]
+                start = time.thread_time()
+                data = decompress(data)
+                self.stats.add_decompress(time.thread_time() - start)
+        return self.inner.decode(data)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Write-behind aggregation of count_calls counters:
+increments add up in process and a background
+thread sends them with INCRBY
+"""
+import atexit
+import os
+import threading
+import weakref
+import redis
+from typing import Callable, Dict, Hashable
+
+
+_buffers = weakref.WeakSet()
+
+
+class CounterBuffer:
+    """
+    Accumulate counter increments and flush them
+    every interval seconds, or as soon as batch
+    increments are pending. close() stops the flusher
+    thread, which only holds a weak reference, and a
+    buffer dropped without close() sends what is
+    pending as it is collected
+    """
+
+    def __init__(self, client: redis.Redis, interval: float = 0.1,
+                 batch: int = 1000):
+        """
+        Constructor method that registers the buffer
+        for the shutdown and fork hooks
+        """
+        self._redis = client
+        self.interval = interval
+        self.batch = batch
+        self._closed = threading.Event()
+        self._reset()
+        _buffers.add(self)
+
+    def _reset(self) -> None:
+        """
+        Start with nothing pending and no flusher,
+        which is also the state of a forked child,
+        whose finalizer must not send the parent's
+        """
+        if getattr(self, "_finalizer", None) is not None:
+            self._finalizer.detach()
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, int] = {}
+        self._count = 0
+        self._queue = self._command()
+        self._finalizer = weakref.finalize(
+            self, _send_dropped, self._redis, self._lock, self._pending,
+            self._queue)
+        self._wake = threading.Event()
+        self._thread = None
+        closed, self._closed = self._closed, threading.Event()
+        if closed.is_set():
+            self._closed.set()
+
+    def add(self, key, amount: int = 1) -> None:
+        """
+        Add to a counter, waking the flusher
+        once a batch is pending. Once closed the
+        increment is sent at once
+        """
+        with self._lock:
+            closed = self._closed.is_set()
+            if not closed:
+                self._pending[key] = self._pending.get(key, 0) + amount
+                self._count += 1
+                full = self._count >= self.batch
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=_flush_periodically,
+                        args=(weakref.ref(self), self._wake, self._closed,
+                              self.interval),
+                        daemon=True)
+                    self._thread.start()
+        if closed:
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue(pipe, key, amount)
+            pipe.execute()
+        elif full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """
+        Send every pending increment in one pipeline,
+        putting them back if Redis cannot be reached
+        """
+        with self._lock:
+            self._count = 0
+        _send(self._redis, self._lock, self._pending, self._queue)
+
+    def _command(self) -> Callable:
+        """
+        Return the function queuing the command of one
+        pending increment, it must not reference the
+        buffer so the finalizer can call it
+        """
+        return _incrby
+
+    def close(self) -> None:
+        """
+        Stop the flusher thread and send what is
+        pending, later increments are sent directly
+        """
+        with self._lock:
+            self._closed.set()
+            thread = self._thread
+        self._wake.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        _buffers.discard(self)
+        self._finalizer.detach()
+        self.flush()
+
+
+def _incrby(pipe, key, amount: int) -> None:
+    """
+    Queue the INCRBY applying one pending increment
+    """
+    pipe.incrby(key, amount)
+
+
+def _send(client: redis.Redis, lock: threading.Lock,
+          pending: Dict[Hashable, int], queue: Callable) -> None:
+    """
+    Send and clear pending increments in one pipeline,
+    putting them back if Redis cannot be reached
+    """
+    with lock:
+        taken = dict(pending)
+        pending.clear()
+    if not taken:
+        return
+    pipe = client.pipeline(transaction=False)
+    for key, amount in taken.items():
+        queue(pipe, key, amount)
+    try:
+        pipe.execute()
+    except redis.RedisError:
+        with lock:
+            for key, amount in taken.items():
+                pending[key] = pending.get(key, 0) + amount
+        raise
+
+
+def _send_dropped(client: redis.Redis, lock: threading.Lock,
+                  pending: Dict[Hashable, int], queue: Callable) -> None:
+    """
+    Send the increments of a buffer collected
+    without close(), if Redis can be reached
+    """
+    try:
+        _send(client, lock, pending, queue)
+    except redis.RedisError:
+        pass
+
+
+def _flush_periodically(ref: weakref.ref, wake: threading.Event,
+                        closed: threading.Event, interval: float) -> None:
+    """
+    Flush a buffer every interval seconds or when woken,
+    until it is closed or no longer referenced
+    """
+    while not closed.is_set():
+        wake.wait(interval)
+        wake.clear()
+        if closed.is_set():
+            return  # close() sends the rest itself
+        buffer = ref()
+        if buffer is None:
+            return
+        try:
+            buffer.flush()
+        except redis.RedisError:
+            pass  # Kept pending, retried on the next tick
+        del buffer
+
+
+def flush_all() -> None:
+    """
+    Flush every live buffer of the process
+    """
+    for buffer in list(_buffers):
+        try:
+            buffer.flush()
+        except redis.RedisError:
+            pass
+
+
+def _after_fork_in_child() -> None:
+    """
+    The parent keeps its pending increments and its
+    flusher threads, so the child starts empty and
+    forking never waits on Redis
+    """
+    for buffer in list(_buffers):
+        buffer._reset()
+
+
+atexit.register(flush_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Content-addressed storage for Cache: every distinct
+value is kept once as a blob named after its BLAKE2
+digest, and the keys handed out point to it
+"""
+import hashlib
+import redis
+from typing import List, Optional, Sequence, Union
+
+
+# Header of a pointer to a blob, followed by the raw digest
+POINTER = b"\x1e\x01"
+# Header of a plain value that happens to start like a pointer
+ESCAPED = b"\x1e\x00"
+DIGEST_SIZE = 16
+
+# KEYS: key, refs
+# ARGV: blob prefix, digest, [value]
+# Without a value only an existing blob is referenced, returns 0 if none
+STORE_SCRIPT = """
+local digest = ARGV[2]
+local blob = ARGV[1] .. digest
+if #ARGV < 3 and redis.call('EXISTS', blob) == 0 then
+    return 0
+end
+redis.call('SET', KEYS[1], '\\30\\1' .. digest)
+if redis.call('HINCRBY', KEYS[2], digest, 1) == 1 then
+    redis.call('SET', blob, ARGV[3])
+end
+return 1
+"""
+
+# KEYS: the keys to read
+# ARGV: blob prefix
+READ_SCRIPT = """
+local values = {}
+for i, key in ipairs(KEYS) do
+    local value = redis.call('GET', key)
+    if value and string.sub(value, 1, 2) == '\\30\\1' then
+        value = redis.call('GET', ARGV[1] .. string.sub(value, 3))
+    end
+    values[i] = value
+end
+return values
+"""
+
+# KEYS: key, refs
+# ARGV: blob prefix
+# Keys that do not hold a string, such as streamed values, are just deleted
+DELETE_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'string' then
+    return redis.call('DEL', KEYS[1])
+end
+local value = redis.call('GET', KEYS[1])
+redis.call('DEL', KEYS[1])
+if string.sub(value, 1, 2) == '\\30\\1' then
+    local digest = string.sub(value, 3)
+    if redis.call('HINCRBY', KEYS[2], digest, -1) <= 0 then
+        redis.call('HDEL', KEYS[2], digest)
+        redis.call('UNLINK', ARGV[1] .. digest)
+    end
+end
+return 1
+"""
+
+
+class Dedup:
+    """
+    Store each distinct value of a namespace once,
+    reference counted in the hash namespace:refs so
+    deleting the last key pointing to a blob frees it.
+    The scripts name blob keys they compute, so the
+    namespace must live on a single server
+    """
+
+    def __init__(self, client: redis.Redis, namespace: str,
+                 lazy_threshold: int = 1024):
+        """
+        Constructor method that registers the scripts.
+        Values of lazy_threshold bytes or more are only
+        sent when no blob holds them yet
+        """
+        self.prefix = namespace.encode("utf-8") + b":blob:"
+        self.refs = namespace + ":refs"
+        self.lazy_threshold = lazy_threshold
+        self._encoder = client.connection_pool.get_encoder()
+        self._store = client.register_script(STORE_SCRIPT)
+        self._read = client.register_script(READ_SCRIPT)
+        self._delete = client.register_script(DELETE_SCRIPT)
+
+    def digest(self, data: bytes) -> bytes:
+        """
+        Return the content address of encoded bytes
+        """
+        return hashlib.blake2b(memoryview(data),
+                               digest_size=DIGEST_SIZE).digest()
+
+    def store(self, client, key: Union[str, bytes], value) -> None:
+        """
+        Point key to the blob of a value, creating the
+        blob for its first reference. client may be a
+        pipeline, which always sends the value
+        """
+        data = self.escape(value)
+        digest = self.digest(data)
+        if len(data) >= self.lazy_threshold and \
+                not isinstance(client, redis.client.Pipeline):
+            # Most large values repeat, try without sending them
+            if self._store(keys=[key, self.refs],
+                           args=[self.prefix, digest], client=client):
+                return
+        self._store(keys=[key, self.refs], args=[self.prefix, digest, data],
+                    client=client)
+
+    def escape(self, value) -> bytes:
+        """
+        Return the bytes to store for a value, escaped
+        if they could be read as a pointer
+        """
+        data = self._encoder.encode(value)
+        return ESCAPED + data if data[:1] == POINTER[:1] else data
+
+    def get_many(self, client: redis.Redis,
+                 keys: Sequence) -> List[Optional[bytes]]:
+        """
+        Return the values of keys, following
+        pointers on the server in one round trip
+        """
+        values = self._read(keys=list(keys), args=[self.prefix],
+                            client=client)
+        return [value[2:] if value is not None and value[:2] == ESCAPED
+                else value for value in values]
+
+    def get(self, client: redis.Redis, key) -> Optional[bytes]:
+        """
+        Return the value of a key
+        """
+        return self.get_many(client, [key])[0]
+
+    def delete(self, client, key) -> int:
+        """
+        Delete a key and drop its blob reference,
+        client may be a pipeline
+        """
+        return self._delete(keys=[key, self.refs], args=[self.prefix],
+                            client=client)
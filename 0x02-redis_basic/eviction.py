@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Bound the number of keys or bytes a Cache
+namespace holds, evicting its oldest or least
+recently used keys in batches
+"""
+import time
+import redis
+from typing import Iterable, Optional
+
+
+# KEYS: index, sizes, total
+# ARGV: key, size, now, max_keys, max_bytes, batch
+TRACK_SCRIPT = """
+local index, sizes, total = KEYS[1], KEYS[2], KEYS[3]
+local key, size = ARGV[1], tonumber(ARGV[2])
+local max_keys, max_bytes = tonumber(ARGV[4]), tonumber(ARGV[5])
+local batch = tonumber(ARGV[6])
+
+local old = redis.call('HGET', sizes, key)
+if old then
+    redis.call('DECRBY', total, old)
+end
+redis.call('ZADD', index, ARGV[3], key)
+redis.call('HSET', sizes, key, size)
+local bytes = redis.call('INCRBY', total, size)
+local count = redis.call('ZCARD', index)
+
+-- Evict at most one batch per write, later writes finish the job
+local evicted = 0
+while evicted < batch and count > 1 do
+    local n = 0
+    if max_keys > 0 and count > max_keys then
+        n = count - max_keys
+    elseif max_bytes > 0 and bytes > max_bytes then
+        n = 1
+    else
+        break
+    end
+    -- Never pop the key that was just written
+    n = math.min(n, batch - evicted, count - 1)
+    local victims = redis.call('ZPOPMIN', index, n)
+    for i = 1, #victims, 2 do
+        local victim = victims[i]
+        local victim_size = redis.call('HGET', sizes, victim)
+        if victim_size then
+            redis.call('HDEL', sizes, victim)
+            bytes = redis.call('DECRBY', total, victim_size)
+        end
+        redis.call('UNLINK', victim)
+    end
+    evicted = evicted + #victims / 2
+    count = count - #victims / 2
+end
+return evicted
+"""
+
+# KEYS: index, sizes, total
+# ARGV: key
+FORGET_SCRIPT = """
+local size = redis.call('HGET', KEYS[2], ARGV[1])
+if size then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('DECRBY', KEYS[3], size)
+end
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+POLICIES = ("fifo", "lru")
+
+
+class NamespaceIndex:
+    """
+    Track the keys of a namespace in a sorted set
+    scored by write (fifo) or access (lru) time, and
+    evict the lowest scores once a cap is exceeded.
+    Each write evicts at most batch keys, so a store
+    stays O(log n) even right after a cap is lowered
+    """
+
+    def __init__(self, client: redis.Redis, namespace: str,
+                 max_keys: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 policy: str = "fifo", batch: int = 64):
+        """
+        Constructor method that registers the tracking script
+        """
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of {}".format(POLICIES))
+        self.index = namespace + ":index"
+        self.sizes = namespace + ":sizes"
+        self.total = namespace + ":bytes"
+        self.max_keys = max_keys or 0
+        self.max_bytes = max_bytes or 0
+        self.policy = policy
+        self.batch = batch
+        self._encoder = client.connection_pool.get_encoder()
+        self._track = client.register_script(TRACK_SCRIPT)
+        self._forget = client.register_script(FORGET_SCRIPT)
+
+    def track(self, client, key: str, data) -> None:
+        """
+        Queue the bookkeeping and any eviction for a
+        written key, client may be a pipeline
+        """
+        size = len(self._encoder.encode(data))
+        self._track(keys=[self.index, self.sizes, self.total],
+                    args=[key, size, time.time(), self.max_keys,
+                          self.max_bytes, self.batch],
+                    client=client)
+
+    def touch(self, client, keys: Iterable[str]) -> None:
+        """
+        Queue an access time update for keys that
+        are still tracked, a no-op under fifo
+        """
+        if self.policy == "lru":
+            now = time.time()
+            client.zadd(self.index, {key: now for key in keys}, xx=True)
+
+    def forget(self, client, key: str) -> None:
+        """
+        Queue the removal of a deleted key from the
+        bookkeeping, client may be a pipeline
+        """
+        self._forget(keys=[self.index, self.sizes, self.total], args=[key],
+                     client=client)
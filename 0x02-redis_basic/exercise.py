@@ -7,10 +7,142 @@ and as a cache also
 
 
 # Import statements
+from backends import Backend, RedisBackend
+from buckets import Buckets
+from codec import Codec, RawCodec, TaggedCodec
+from dedup import Dedup
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from counters import CounterBuffer
 from functools import wraps  # For decorators
+import hashlib
+import histogram
+import inspect
+from eviction import NamespaceIndex
+from itertools import islice
+from keys import KeyStrategy, UUIDKeys
+from near_cache import NearCache
+from pool import get_client, get_cluster
+from snapshots import restore_snapshot, write_snapshot
+from streams import ChunkReader, hash_tagged, write_stream
+import itertools
+import math
 import redis
-import uuid
-from typing import Union, Callable, Optional
+import os
+import random
+import threading
+import time
+import warnings
+from typing import Union, Callable, Optional, Iterable, List
+
+
+@contextmanager
+def _pipeline(self):
+    """
+    Yield the client a decorated call queues its commands on.
+    A pipelined instance shares one pipeline between the
+    decorators and the wrapped method, and the outermost
+    caller flushes it once, even when the call fails
+    """
+    local = getattr(self, "_local", None)
+    if local is None or not getattr(self, "_pipelined", False):
+        yield self._redis
+        return
+
+    pipe = getattr(local, "pipe", None)
+    if pipe is not None:
+        # Nested call, the outermost caller flushes
+        yield pipe
+        return
+
+    pipe = self._redis.pipeline(transaction=self._atomic)
+    local.pipe = pipe
+    try:
+        yield pipe
+    except BaseException:
+        # Still send the count and input of a failed call, as
+        # unpipelined calls do, keeping the error of the call
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            pass
+        raise
+    else:
+        pipe.execute()
+    finally:
+        local.pipe = None
+        pipe.reset()
+
+
+def _meta_key(self, name: str) -> str:
+    """
+    Return the key of a counter or history,
+    inside the namespace of self when it has one.
+    On a cluster the name is a hash tag, so a
+    counter and its history share one slot
+    """
+    if getattr(self, "_cluster", False):
+        name = "{" + name + "}"
+    namespace = getattr(self, "_namespace", None)
+    return name if namespace is None else "{}:{}".format(namespace, name)
+
+
+def _data_key(self, key: Union[str, bytes]) -> Union[str, bytes]:
+    """
+    Return a generated key with the namespace
+    prefix of self, keeping its str or bytes type
+    """
+    namespace = getattr(self, "_namespace", None)
+    if namespace is None:
+        return key
+    if isinstance(key, bytes):
+        return namespace.encode("utf-8") + b":" + key
+    return "{}:{}".format(namespace, key)
+
+
+def _scan_pattern(namespace: str) -> str:
+    """
+    Return the SCAN pattern matching the data
+    and meta keys of a namespace, and only those
+    """
+    escaped = "".join("\\" + char if char in "*?[]\\" else char
+                      for char in namespace)
+    return escaped + ":*"
+
+
+# The (instance, pipeline) shared by the current asyncio task
+_async_pipe = ContextVar("_async_pipe", default=None)
+
+
+@asynccontextmanager
+async def _async_pipeline(self):
+    """
+    Yield the pipeline a decorated coroutine queues its
+    commands on. Coroutine methods always share one
+    pipeline per call, flushed once by the outermost
+    even when the call fails
+    """
+    current = _async_pipe.get()
+    if current is not None and current[0] is self:
+        # Nested call, the outermost caller flushes
+        yield current[1]
+        return
+
+    pipe = self._redis.pipeline(transaction=getattr(self, "_atomic", False))
+    token = _async_pipe.set((self, pipe))
+    try:
+        yield pipe
+    except BaseException:
+        try:
+            await pipe.execute()
+        except redis.RedisError:
+            pass
+        raise
+    else:
+        await pipe.execute()
+    finally:
+        _async_pipe.reset(token)
+        await pipe.reset()
 
 
 # Defining the decorators above the Cache class
@@ -20,70 +152,587 @@ def count_calls(method: Callable) -> Callable:
     """
     key = method.__qualname__
 
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            """
+            A Wrapper for decorated coroutine
+            """
+            async with _async_pipeline(self) as client:
+                client.incr(_meta_key(self, key))
+                return await method(self, *args, **kwargs)
+
+        return async_wrapper
+
     @wraps(method)
     def wrapper(self, *args, **kwargs):
         """
         A Wrapper for decorated function
         """
-        self._redis.incr(key)
-        return method(self, *args, **kwargs)
+        if getattr(self, "_scripted", False):
+            # Counted by the method's own script
+            return method(self, *args, **kwargs)
+        buffer = getattr(self, "_counter_buffer", None)
+        if buffer is not None:
+            buffer.add(_meta_key(self, key))
+            return method(self, *args, **kwargs)
+        with _pipeline(self) as client:
+            client.incr(_meta_key(self, key))
+            return method(self, *args, **kwargs)
 
     return wrapper
 
 
+def _timer(args: tuple):
+    """
+    Return the buffer a call records into: the one of
+    the instance for methods of a Cache, which has none
+    unless timed=True, else the one of the process,
+    which histogram.enable() starts
+    """
+    if args and hasattr(args[0], "_recorder"):
+        return args[0]._recorder
+    return histogram.recorder()
+
+
+def time_calls(fn: Callable) -> Callable:
+    """
+    Record the latency of every call in the
+    histogram of its qualname, see histogram.py.
+    Nothing is timed until enabled
+    """
+    name = fn.__qualname__
+
+    if inspect.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            """
+            A Wrapper for decorated coroutine
+            """
+            timer = _timer(args)
+            if timer is None:
+                return await fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timer.record(name, time.perf_counter() - start)
+
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        """
+        A Wrapper for decorated function
+        """
+        timer = _timer(args)
+        if timer is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timer.record(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def _sampled(self) -> bool:
+    """
+    Tell whether the history of this call is kept,
+    one call in history_sample is
+    """
+    sample = getattr(self, "_history_sample", 1)
+    if sample <= 1:
+        return True
+    return next(self._history_calls) % sample == 0
+
+
+def _push_trimmed(client, qualname: str, inputs: List[str],
+                  outputs: List[str], limit: int) -> None:
+    """
+    Queue the history of some calls on client,
+    keeping only the last limit entries of each list
+    """
+    client.rpush(qualname + ":inputs", *inputs)
+    client.rpush(qualname + ":outputs", *outputs)
+    client.ltrim(qualname + ":inputs", -limit, -1)
+    client.ltrim(qualname + ":outputs", -limit, -1)
+
+
+def _log_calls(self, client, qualname: str, inputs: List[str],
+               outputs: List[str], durations: List[float]) -> None:
+    """
+    Queue the history of some calls on client, as one
+    stream entry per call or as two parallel lists
+    """
+    limit = getattr(self, "_history_limit", None)
+    if getattr(self, "_history", "lists") == "stream":
+        now = time.time()
+        for input, output, duration in zip(inputs, outputs, durations):
+            client.xadd(qualname + ":history",
+                        {"input": input, "output": output,
+                         "time": now, "duration": duration},
+                        maxlen=limit, approximate=True)
+    elif limit:
+        _push_trimmed(client, qualname, inputs, outputs, limit)
+    else:
+        client.rpush(qualname + ":inputs", *inputs)
+        client.rpush(qualname + ":outputs", *outputs)
+
+
 def call_history(method: Callable) -> Callable:
     """
     Store history of inputs and
     outputs for a particular function
     """
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            """
+            A wrapper for the decorated
+            coroutine call_history
+            """
+            if not _sampled(self):
+                return await method(self, *args, **kwargs)
+
+            input = str(args)  # Normalizing
+            async with _async_pipeline(self) as client:
+                start = time.perf_counter()
+                result = await method(self, *args, **kwargs)
+                qualname = _meta_key(self, method.__qualname__)
+                _log_calls(self, client, qualname, [input], [str(result)],
+                           [time.perf_counter() - start])
+            return result
+
+        return async_wrapper
+
     @wraps(method)
     def wrapper(self, *args, **kwargs):
         """
         A wrapper for the decorated
         function call_history
         """
+        if getattr(self, "_scripted", False):
+            # Logged by the method's own script
+            self._local.history_input = str(args) if _sampled(self) \
+                else None
+            self._local.history_start = time.perf_counter()
+            return method(self, *args, **kwargs)
+        if not _sampled(self):
+            return method(self, *args, **kwargs)
+
         input = str(args)  # Normalizing
-        self._redis.rpush(method.__qualname__ + ":inputs", input)
-        output = str(method(self, *args, **kwargs))
-        self._redis.rpush(method.__qualname__ + ":outputs", output)
-        return output
+        qualname = _meta_key(self, method.__qualname__)
+        with _pipeline(self) as client:
+            if getattr(self, "_history", "lists") == "lists" and \
+                    not getattr(self, "_history_limit", None):
+                client.rpush(qualname + ":inputs", input)
+                result = method(self, *args, **kwargs)
+                client.rpush(qualname + ":outputs", str(result))
+                return result
+
+            # Written after the call, in one MULTI unless pipelined
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            duration = time.perf_counter() - start
+            if client is self._redis:
+                client = self._redis.pipeline()
+                _log_calls(self, client, qualname,
+                           [input], [str(result)], [duration])
+                client.execute()
+            else:
+                _log_calls(self, client, qualname,
+                           [input], [str(result)], [duration])
+        return result
 
     return wrapper
 
 
-def replay(fn: Callable):
+# KEYS: key, counter, then inputs and outputs, or history, or nothing
+# ARGV: value, ttl, history limit, then input, output, time and duration
+STORE_SCRIPT = """
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+redis.call('INCR', KEYS[2])
+local limit = tonumber(ARGV[3])
+if #KEYS == 3 then
+    if limit > 0 then
+        redis.call('XADD', KEYS[3], 'MAXLEN', '~', limit, '*',
+                   'input', ARGV[4], 'output', ARGV[5], 'time', ARGV[6],
+                   'duration', ARGV[7])
+    else
+        redis.call('XADD', KEYS[3], '*',
+                   'input', ARGV[4], 'output', ARGV[5], 'time', ARGV[6],
+                   'duration', ARGV[7])
+    end
+elseif #KEYS == 4 then
+    redis.call('RPUSH', KEYS[3], ARGV[4])
+    redis.call('RPUSH', KEYS[4], ARGV[5])
+    if limit > 0 then
+        redis.call('LTRIM', KEYS[3], -limit, -1)
+        redis.call('LTRIM', KEYS[4], -limit, -1)
+    end
+end
+return 1
+"""
+
+# Delete a memoize lock only while it holds our token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _memo_key(prefix: str, qualname: str, args: tuple, kwargs: dict) -> str:
     """
-    Display the history of calls of a particular function
+    Return a key that is the same for equal
+    arguments in every process, refusing arguments
+    whose repr holds a memory address
+    """
+    normalized = repr((args, sorted(kwargs.items())))
+    if " at 0x" in normalized:
+        raise TypeError("cannot memoize {} on arguments without a stable "
+                        "repr: {}".format(qualname, normalized))
+    normalized = normalized.encode("utf-8")
+    digest = hashlib.blake2b(normalized, digest_size=16).hexdigest()
+    return "{}:{}:{}".format(prefix, qualname, digest)
+
+
+def memoize(ttl: int = 60, codec: Optional[Codec] = None,
+            lock_timeout: float = 5.0, beta: float = 1.0,
+            prefix: str = "memoize") -> Callable:
+    """
+    Cache the results of a pure function for ttl
+    seconds under a hash of its arguments. Only the
+    caller holding a short lock recomputes a missing
+    result, the others wait for it. Hot results are
+    recomputed early with probability rising towards
+    their expiry (XFetch), beta > 1 favors earlier.
+    Arguments must have a repr without a memory
+    address. The default TaggedCodec returns tuples
+    as lists, and results it cannot encode are
+    returned uncached with a warning
+    """
+    codec = codec or TaggedCodec()
+    release = get_client().register_script(RELEASE_SCRIPT)
+
+    def decorator(fn: Callable) -> Callable:
+        """
+        Returns a Callable object
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            """
+            A wrapper for the memoized function
+            """
+            client = get_client()
+            key = _memo_key(prefix, fn.__qualname__, args, kwargs)
+            value, delta, expiry = client.hmget(key, "value", "delta",
+                                                "expiry")
+            if value is not None:
+                # XFetch: -log(random()) is exponentially distributed
+                early = float(delta) * beta * -math.log(1.0 - random.random())
+                if time.time() + early < float(expiry):
+                    return codec.decode(value)
+
+            lock = key + ":lock"
+            token = os.urandom(8).hex()
+            locked = client.set(lock, token, nx=True,
+                                px=int(lock_timeout * 1000))
+            if not locked:
+                if value is not None:
+                    return codec.decode(value)  # Being refreshed
+                deadline = time.monotonic() + lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.01)
+                    value = client.hget(key, "value")
+                    if value is not None:
+                        return codec.decode(value)
+                    if not client.exists(lock):
+                        break  # The holder failed, compute it here
+
+            try:
+                start = time.perf_counter()
+                result = fn(*args, **kwargs)
+                delta = time.perf_counter() - start
+                try:
+                    encoded = codec.encode(result)
+                except TypeError as error:
+                    warnings.warn("{} result not cached: {}".format(
+                        fn.__qualname__, error), RuntimeWarning)
+                    return result
+                pipe = client.pipeline()
+                pipe.hset(key, mapping={"value": encoded, "delta": delta,
+                                        "expiry": time.time() + ttl})
+                pipe.expire(key, ttl)
+                pipe.execute()
+            finally:
+                if locked:
+                    release(keys=[lock], args=[token], client=client)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _queue_values(self, pipe, chunk: list,
+                  ttl: Optional[int] = None) -> List[str]:
+    """
+    Queue the writes of a batch of values on pipe, with
+    the count_calls and call_history entries store would
+    have made for each, and return their new keys
+    """
+    qualname = _meta_key(self, self.store.__qualname__)
+    start = time.perf_counter()
+    mapping = dict(zip([_data_key(self, key)
+                        for key in self._keys.new_keys(len(chunk))],
+                       [self._codec.encode(value) for value in chunk]))
+    logged = [i for i in range(len(chunk)) if _sampled(self)]
+    if self._counter_buffer is not None:
+        self._counter_buffer.add(qualname, len(chunk))
+    else:
+        pipe.incrby(qualname, len(chunk))
+    buckets = getattr(self, "_buckets", None)
+    dedup = getattr(self, "_dedup", None)
+    plain = mapping
+    if dedup is not None:
+        if ttl is None:
+            for key, value in mapping.items():
+                dedup.store(pipe, key, value)
+            plain = {}
+        else:
+            plain = {key: dedup.escape(value)
+                     for key, value in mapping.items()}
+    elif buckets is not None and ttl is None:
+        small = {key: value for key, value in mapping.items()
+                 if buckets.fits(key, value)}
+        buckets.set_many(pipe, small)
+        plain = {key: value for key, value in mapping.items()
+                 if key not in small}
+    if plain and ttl is None and not getattr(self, "_cluster", False):
+        pipe.mset(plain)
+    else:  # A cluster pipeline routes each SET to its slot
+        for key, value in plain.items():
+            pipe.set(key, value, ex=ttl)
+    if self._index is not None:
+        for key, value in mapping.items():
+            self._index.track(pipe, key, value)
+    keys = list(mapping)
+    if logged:
+        duration = (time.perf_counter() - start) / len(chunk)
+        _log_calls(self, pipe, qualname,
+                   [str((chunk[i],)) for i in logged],
+                   [str(keys[i]) for i in logged],
+                   [duration] * len(logged))
+    return keys
+
+
+def _as_str(value) -> str:
+    """
+    Convert a decoded value for get_str
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _as_int(value) -> int:
+    """
+    Convert a decoded value for get_int, 0 when it is not a number
     """
-    r = redis.Redis()
-    function_name = fn.__qualname__
-    value = r.get(function_name)
     try:
-        value = int(value.decode("utf-8"))
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        value = int(value)
     except Exception:
         value = 0
+    return value
 
-    # print(f"{function_name} was called {value} times")
-    print("{} was called {} times:".format(function_name, value))
-    # inputs = r.lrange(f"{function_name}:inputs", 0, -1)
-    inputs = r.lrange("{}:inputs".format(function_name), 0, -1)
 
-    # outputs = r.lrange(f"{function_name}:outputs", 0, -1)
-    outputs = r.lrange("{}:outputs".format(function_name), 0, -1)
+def _decode(value: Optional[bytes]) -> str:
+    """
+    Decode a history entry, unreadable ones become ""
+    """
+    try:
+        return value.decode("utf-8")
+    except Exception:
+        return ""
 
-    for input, output in zip(inputs, outputs):
-        try:
-            input = input.decode("utf-8")
-        except Exception:
-            input = ""
 
+class History:
+    """
+    A lazy view of the call history of a method.
+    The counter and the first page are read in one
+    pipelined round trip, every further page in one
+    more, so memory stays flat however long it is
+    """
+
+    def __init__(self, fn: Callable, start: int = 0,
+                 limit: Optional[int] = None, reverse: bool = False,
+                 chunk_size: int = 500, client: Optional[redis.Redis] = None):
+        """
+        Constructor method that reads the counter
+        and the first page of history, from the
+        client of the instance fn is bound to
+        """
+        if client is None:
+            client = getattr(getattr(fn, "__self__", None), "_redis", None)
+            if not isinstance(client, (redis.Redis, redis.RedisCluster,
+                                       Backend)):
+                client = get_client()  # Unbound, or an asyncio client
+        self._setup(fn, client, start, limit, reverse, chunk_size)
+        if self._stream is None:
+            self._stream = \
+                self._redis.type(self._key + ":history") == b"stream"
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_first(pipe)
+        self._read_first(pipe.execute())
+
+    def _setup(self, fn: Callable, client, start: int,
+               limit: Optional[int], reverse: bool,
+               chunk_size: int) -> None:
+        """
+        Set the paging state, the history mode is left
+        None when fn is not bound to a Cache
+        """
+        owner = getattr(fn, "__self__", None)
+        self.name = fn.__qualname__
+        self.calls = 0
+        self._key = _meta_key(owner, self.name)
+        self._redis = client
+        mode = getattr(owner, "_history", None)
+        self._stream = None if mode is None else mode == "stream"
+        self._start = start
+        self._reverse = reverse
+        self._chunk_size = chunk_size
+        self._remaining = limit
+        self._cursor = "+" if reverse else "-"
+        self._page = []
+
+    def _queue_first(self, pipe) -> None:
+        """
+        Queue the counter read and the first page
+        """
+        self._offset = 0 if self._stream else self._start
+        self._skip = self._start if self._stream else 0  # Streams page past
+        pipe.get(self._key)
+        self._queue_page(pipe)
+
+    def _read_first(self, results: list) -> None:
+        """
+        Keep the counter and the first page
+        """
         try:
-            output = output.decode("utf-8")
+            self.calls = int(results[0].decode("utf-8"))
         except Exception:
-            output = ""
+            self.calls = 0
+        self._page = self._read_page(results[1:])
+
+    def _take(self, page: list):
+        """
+        Yield the decoded pairs of a page, skipping
+        up to start and stopping at limit
+        """
+        for input, output in page:
+            if self._skip:
+                self._skip -= 1
+                continue
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    return
+                self._remaining -= 1
+            yield _decode(input), _decode(output)
+
+    def _done(self, page: list) -> bool:
+        """
+        Tell whether no page follows this one
+        """
+        return len(page) < self._requested or self._cursor is None or \
+            self._remaining == 0
+
+    def __iter__(self):
+        """
+        Yield (input, output) pairs, fetching
+        the next page once this one is used up
+        """
+        page, self._page = self._page, []
+        while True:
+            yield from self._take(page)
+            if self._done(page):
+                return
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_page(pipe)
+            page = self._read_page(pipe.execute())
+
+    def _queue_page(self, pipe) -> None:
+        """
+        Queue the commands reading the next page
+        """
+        n = self._chunk_size
+        if self._remaining is not None and not self._skip:
+            n = max(min(n, self._remaining), 1)
+        self._requested = n
+        if self._stream:
+            if self._reverse:
+                pipe.xrevrange(self._key + ":history",
+                               max=self._cursor, count=n)
+            else:
+                pipe.xrange(self._key + ":history",
+                            min=self._cursor, count=n)
+            return
+        if self._reverse:
+            first, last = -self._offset - n, -self._offset - 1
+        else:
+            first, last = self._offset, self._offset + n - 1
+        pipe.lrange(self._key + ":inputs", first, last)
+        pipe.lrange(self._key + ":outputs", first, last)
 
-        # print(f"{function_name}(*{input}) -> {output}")
-        print("{}(*{}) -> {}".format(function_name, input, output))
+    def _read_page(self, results: list) -> list:
+        """
+        Turn the replies of _queue_page into
+        (input, output) pairs and advance
+        """
+        if not self._stream:
+            inputs, outputs = results
+            if self._reverse:
+                inputs.reverse()
+                outputs.reverse()
+            self._offset += len(inputs)
+            return list(zip(inputs, outputs))
+
+        entries = results[0]
+        if entries:
+            ms, seq = map(int, entries[-1][0].decode("utf-8").split("-"))
+            if not self._reverse:
+                self._cursor = "{}-{}".format(ms, seq + 1)
+            elif seq:
+                self._cursor = "{}-{}".format(ms, seq - 1)
+            elif ms:
+                self._cursor = "{}-{}".format(ms - 1, 2 ** 64 - 1)
+            else:
+                self._cursor = None  # Nothing precedes 0-0
+        return [(fields.get(b"input"), fields.get(b"output"))
+                for _, fields in entries]
+
+
+def replay(fn: Callable, start: int = 0, limit: Optional[int] = None,
+           reverse: bool = False):
+    """
+    Display the history of calls of a particular function,
+    optionally from the start-th entry, at most limit
+    entries, newest first when reverse is True
+    """
+    history = History(fn, start, limit, reverse)
+    print("{} was called {} times:".format(history.name, history.calls))
+    for input, output in history:
+        print("{}(*{}) -> {}".format(history.name, input, output))
 
 
 class Cache:
@@ -91,25 +740,408 @@ class Cache:
     A cache class
     """
 
-    def __init__(self):
+    def __init__(self, pipelined: bool = False, atomic: bool = False,
+                 near_cache: Optional[int] = None,
+                 max_keys: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 eviction: str = "fifo",
+                 codec: Optional[Codec] = None,
+                 history: str = "lists",
+                 history_limit: Optional[int] = None,
+                 history_sample: int = 1,
+                 count_interval: Optional[float] = None,
+                 count_batch: int = 1000,
+                 keys: Optional[KeyStrategy] = None,
+                 namespace: Optional[str] = None,
+                 cluster: Optional[str] = None,
+                 scripted: bool = False,
+                 buckets: Optional[int] = None,
+                 bucket_max_value: int = 64,
+                 dedup: bool = False,
+                 backend: Optional[Backend] = None,
+                 timed: bool = False):
         """
         Constructor method that stores
-        an instance of the Redis client
+        an instance of the Redis client.
+        With pipelined=True every store sends its INCR,
+        RPUSH and SET commands in a single round trip,
+        and atomic=True wraps them in MULTI/EXEC.
+        near_cache is the size in bytes of an optional
+        in-process cache serving repeated reads.
+        max_keys and max_bytes cap the stored values,
+        evicting the oldest (fifo) or least recently
+        read (lru) ones first. codec turns values into
+        bytes and back, pass a codec.TaggedCodec() to
+        have get return the stored type.
+        call_history keeps the last history_limit calls
+        of one call in history_sample, either in two
+        lists or, with history="stream", as one stream
+        entry per call.
+        With count_interval set, count_calls adds up
+        counts in process and flushes them every
+        count_interval seconds or count_batch calls.
+        keys generates the key of each stored value,
+        see keys.py for more compact strategies.
+        With a namespace every key starts with
+        "namespace:" and the database is not flushed,
+        clear() removes the namespace alone.
+        cluster is the host:port of any node of a
+        Redis Cluster to use instead of one server,
+        without atomic, near_cache or eviction.
+        With scripted=True store, its count and its
+        history run as one cached Lua script, a single
+        atomic round trip.
+        buckets packs values of up to bucket_max_value
+        bytes stored without a ttl into the fields of
+        that many hashes, around items / 100 of them,
+        full ones spill to plain keys.
+        With dedup=True values stored without a ttl
+        are kept once per distinct content, delete()
+        frees a value with its last key.
+        backend is where the data lives, see backends.py,
+        only a RedisBackend runs scripts, the stream
+        history and the options built on them. A
+        MemoryBackend with max_keys only evicts stored
+        values, never counts or history.
+        With timed=True store and get record their
+        latency into histograms in the namespace,
+        see latency()
+        """
+        if history not in ("lists", "stream"):
+            raise ValueError("history must be 'lists' or 'stream'")
+        if cluster is not None and (atomic or near_cache or max_keys or
+                                    max_bytes):
+            raise ValueError("atomic, near_cache and eviction need "
+                             "a single server")
+        if scripted and (pipelined or atomic or max_keys or max_bytes or
+                         count_interval is not None or cluster is not None):
+            raise ValueError("scripted stores cannot be pipelined, "
+                             "evicted, buffered or clustered")
+        if buckets and (scripted or near_cache or max_keys or max_bytes or
+                        cluster is not None):
+            raise ValueError("buckets cannot be scripted, near cached, "
+                             "evicted or clustered")
+        if dedup and (buckets or scripted or near_cache or max_keys or
+                      max_bytes or cluster is not None):
+            raise ValueError("dedup cannot be bucketed, scripted, near "
+                             "cached, evicted or clustered")
+        if backend is not None and (cluster is not None or (
+                not isinstance(backend, RedisBackend) and (
+                    history == "stream" or scripted or near_cache or
+                    max_keys or max_bytes or buckets or dedup))):
+            raise ValueError("only a RedisBackend supports stream history, "
+                             "scripts, near_cache, eviction, buckets and "
+                             "dedup, and a backend cannot be clustered")
+        self._cluster = cluster is not None
+        if self._cluster:
+            host, _, port = cluster.rpartition(":")
+            self._redis = get_cluster(host or "localhost", int(port))
+        elif backend is not None:
+            self._redis = backend
+        else:
+            self._redis = get_client()
+        self._namespace = namespace
+        if namespace is None:
+            self._redis.flushdb()
+        self._pipelined = pipelined or atomic
+        self._atomic = atomic
+        self._local = threading.local()  # Per-thread shared pipeline
+        self._scripted = scripted
+        self._store_script = None
+        if scripted:
+            # EVALSHA, loading the script again on NOSCRIPT
+            self._store_script = self._redis.register_script(STORE_SCRIPT)
+        self._codec = codec or RawCodec()
+        self._keys = keys or UUIDKeys()
+        self._history = history
+        self._history_limit = history_limit
+        self._history_sample = history_sample
+        self._history_calls = itertools.count()
+        self._counter_buffer = None
+        if count_interval is not None:
+            self._counter_buffer = CounterBuffer(self._redis, count_interval,
+                                                 count_batch)
+        self._recorder = None
+        if timed:
+            self._recorder = histogram.HistogramBuffer(
+                self._redis, prefix=_meta_key(self, histogram.PREFIX))
+        self._index = None
+        if max_keys or max_bytes:
+            self._index = NamespaceIndex(self._redis, namespace or "Cache",
+                                         max_keys, max_bytes, eviction)
+        self._dedup = None
+        if dedup:
+            self._dedup = Dedup(self._redis, namespace or "Cache")
+        self._buckets = None
+        if buckets:
+            self._buckets = Buckets(self._redis, namespace or "Cache",
+                                    buckets, bucket_max_value)
+        self._near = None
+        if near_cache:
+            shared = self._redis.connection_pool  # Same limits
+            self._near = NearCache(near_cache,
+                                   getattr(shared, "max_connections", None),
+                                   getattr(shared, "timeout", None),
+                                   **shared.connection_kwargs)
+
+    def _fetch(self, key: str) -> Optional[bytes]:
+        """
+        Read the raw value of a key, through
+        the near cache when there is one
+        """
+        if self._near is not None:
+            return self._near.get(key)
+        if self._buckets is not None:
+            return self._buckets.get(self._redis, key)
+        if self._dedup is not None:
+            return self._dedup.get(self._redis, key)
+        if self._index is not None and self._index.policy == "lru":
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.get(key)
+            self._index.touch(pipe, [key])
+            return pipe.execute()[0]
+        return self._redis.get(key)
+
+    def flush_counts(self) -> None:
+        """
+        Send the buffered count_calls increments now
         """
-        self._redis = redis.Redis()
-        self._redis.flushdb()
+        if self._counter_buffer is not None:
+            self._counter_buffer.flush()
 
+    def close(self) -> None:
+        """
+        Stop the background threads of the cache after
+        flushing its buffered counts and latencies.
+        Later calls count directly, untimed and without
+        the near cache
+        """
+        for buffer in (self._counter_buffer, self._recorder):
+            if buffer is not None:
+                buffer.close()
+        self._counter_buffer = self._recorder = None
+        if self._near is not None:
+            self._near.close()
+            self._near = None
+
+    def latency(self, name: Optional[str] = None,
+                quantiles: Iterable[float] = histogram.QUANTILES) -> dict:
+        """
+        Return the latency percentiles, in seconds, of
+        the qualname of a timed method, store by default,
+        over every process timing it
+        """
+        if self._recorder is None:
+            raise ValueError("the cache is not timed")
+        if name is None:
+            name = self.store.__qualname__
+        self._recorder.flush()
+        timings = histogram.load(name, self._redis, self._recorder.prefix)
+        if not timings.total:
+            raise ValueError("no latencies recorded for {}".format(name))
+        return {quantile: timings.percentile(quantile)
+                for quantile in quantiles}
+
+    def clear(self, batch: int = 1000) -> int:
+        """
+        Remove every key of the namespace with SCAN and
+        UNLINK, batch keys per round trip, without
+        blocking the server the way FLUSHDB or KEYS
+        would. Flushes the database when the cache has
+        no namespace. Returns the number of keys removed
+        """
+        self.flush_counts()  # Or pending counts would come back later
+        if self._recorder is not None:
+            self._recorder.flush()
+        if self._namespace is None:
+            self._redis.flushdb()
+            return 0
+        removed = 0
+        keys = self._redis.scan_iter(match=_scan_pattern(self._namespace),
+                                     count=batch)
+        while True:
+            chunk = list(islice(keys, batch))
+            if not chunk:
+                break
+            removed += self._redis.unlink(*chunk)
+            if self._near is not None:
+                self._near.publish(self._redis, chunk)
+        return removed
+
+    def _need_dump(self) -> None:
+        """
+        Refuse snapshots on a backend without DUMP and RESTORE
+        """
+        if isinstance(self._redis, Backend) and \
+                not isinstance(self._redis, RedisBackend):
+            raise ValueError("snapshots need DUMP and RESTORE, "
+                             "only a RedisBackend has them")
+
+    def export(self, fileobj, batch: int = 1000) -> int:
+        """
+        Write a snapshot of the namespace, or of the
+        whole database without one, to a binary file,
+        batch keys per round trip. Returns the number
+        of keys written
+        """
+        self._need_dump()
+        self.flush_counts()
+        pattern = "*" if self._namespace is None \
+            else _scan_pattern(self._namespace)
+        return write_snapshot(self._redis, pattern, fileobj, batch)
+
+    def restore(self, fileobj, batch: int = 1000,
+                replace: bool = True) -> int:
+        """
+        Load a snapshot written by export, with the
+        expiries it had, batch keys per round trip.
+        Returns the number of keys restored
+        """
+        self._need_dump()
+        on_batch = None
+        if self._near is not None:
+            def on_batch(keys):
+                self._near.publish(self._redis, keys)
+        return restore_snapshot(self._redis, fileobj, batch, replace,
+                                on_batch)
+
+    def near_cache_stats(self) -> Optional[dict]:
+        """
+        Return the near cache hit and miss counters
+        """
+        return self._near.stats() if self._near is not None else None
+
+    @time_calls
     @count_calls
     @call_history
-    def store(self, data: Union[str, bytes, int, float]) -> str:
+    def store(self, data: Union[str, bytes, int, float],
+              ttl: Optional[int] = None) -> Union[str, bytes]:
         """
         Method that takes a data argument
-        and returns a key
+        and returns a key, expiring after
+        ttl seconds when it is given
         """
-        random_key = str(uuid.uuid4())
-        self._redis.set(random_key, data)
+        random_key = _data_key(self, self._keys.new_key())
+        value = self._codec.encode(data)
+        if self._scripted:
+            self._run_store_script(random_key, value, ttl)
+            return random_key
+        with _pipeline(self) as client:
+            if self._dedup is not None:
+                if ttl is None:
+                    self._dedup.store(client, random_key, value)
+                else:
+                    client.set(random_key, self._dedup.escape(value), ex=ttl)
+                return random_key
+            if self._buckets is not None and ttl is None and \
+                    self._buckets.fits(random_key, value):
+                self._buckets.set_many(client, {random_key: value})
+                return random_key
+            client.set(random_key, value, ex=ttl)
+            if self._index is not None:
+                self._index.track(client, random_key, value)
         return random_key
 
+    def _run_store_script(self, key: Union[str, bytes], value,
+                          ttl: Optional[int]) -> None:
+        """
+        Write a value with its count and, when
+        call_history sampled the call, its history.
+        The duration logged stops as the script is sent
+        """
+        qualname = _meta_key(self, self.store.__qualname__)
+        keys = [key, qualname]
+        args = [value, ttl or 0, self._history_limit or 0]
+        input = getattr(self._local, "history_input", None)
+        if input is not None:
+            self._local.history_input = None
+            if self._history == "stream":
+                keys.append(qualname + ":history")
+            else:
+                keys.extend([qualname + ":inputs", qualname + ":outputs"])
+            duration = time.perf_counter() - self._local.history_start
+            args.extend([input, str(key), time.time(), duration])
+        self._store_script(keys=keys, args=args)
+
+    def store_many(self,
+                   values: Iterable[Union[str, bytes, int, float]],
+                   ttl: Optional[int] = None,
+                   chunk_size: int = 1000) -> List[Union[str, bytes]]:
+        """
+        Store many values with MSET, one pipeline per chunk,
+        and return their keys in input order. Each item is
+        counted and logged under store's keys, exactly as
+        if store had been called once per value
+        """
+        values = iter(values)
+        keys = []
+        while True:
+            chunk = list(islice(values, chunk_size))
+            if not chunk:
+                break
+            pipe = self._redis.pipeline(transaction=self._atomic)
+            keys.extend(_queue_values(self, pipe, chunk, ttl))
+            pipe.execute()
+        return keys
+
+    def _client_for(self, key: Union[str, bytes]):
+        """
+        Return the client holding a key
+        """
+        return self._redis
+
+    def store_stream(self, fileobj, chunk_size: int = 1 << 20,
+                     ttl: Optional[int] = None,
+                     window: int = 8) -> Union[str, bytes]:
+        """
+        Store what a binary file yields, holding at most
+        window chunks of chunk_size bytes in memory, and
+        return a key to read it back with open()
+        """
+        key = self._keys.new_key()
+        if self._cluster:
+            # Keep key and its partial copy in one slot for RENAME
+            tagged = hash_tagged(key)
+            while tagged is None:
+                tagged = hash_tagged(self._keys.new_key())
+            key = tagged
+        key = _data_key(self, key)
+        write_stream(self._client_for(key), key, fileobj, chunk_size,
+                     window, ttl)
+        return key
+
+    def open(self, key: Union[str, bytes],
+             window: int = 8) -> Optional[ChunkReader]:
+        """
+        Return a seekable file-like reader over a value
+        stored with store_stream, None for a missing key
+        """
+        return ChunkReader.open(self._client_for(key), key, window)
+
+    def delete(self, key: Union[str, bytes]) -> bool:
+        """
+        Remove a stored value and tell whether it was
+        there. A deduplicated value is freed along
+        with the last key pointing to it
+        """
+        client = self._client_for(key)
+        if self._dedup is not None:
+            return bool(self._dedup.delete(client, key))
+        pipe = client.pipeline(transaction=self._atomic)
+        pipe.unlink(key)
+        if self._buckets is not None:
+            pipe.hdel(self._buckets.bucket(key), key)
+        if self._index is not None:
+            self._index.forget(pipe, key)
+        results = pipe.execute()
+        if self._near is not None:
+            self._near.publish(self._redis, [key])
+        removed = results[0]
+        if self._buckets is not None:
+            removed += results[1]
+        return bool(removed)
+
+    @time_calls
     def get(self,
             key: str,
             fn: Optional[Callable] = None) -> Union[str,
@@ -121,28 +1153,57 @@ class Cache:
         and returns the data in the desired
         format
         """
-        data = self._redis.get(key)
+        data = self._codec.decode(self._fetch(key))
         if fn:
             data = fn(data)
         return data
 
+    def get_many(self,
+                 keys: Iterable[str],
+                 fn: Optional[Callable] = None,
+                 chunk_size: int = 1000) -> List:
+        """
+        Fetch many keys with one MGET per chunk and
+        return the values in input order, converted
+        with fn when it is given
+        """
+        keys = iter(keys)
+        values = []
+        while True:
+            chunk = list(islice(keys, chunk_size))
+            if not chunk:
+                break
+            if self._near is not None:
+                values.extend(self._near.mget(chunk))
+            elif self._buckets is not None:
+                values.extend(self._buckets.get_many(self._redis, chunk))
+            elif self._dedup is not None:
+                values.extend(self._dedup.get_many(self._redis, chunk))
+            elif self._index is not None and self._index.policy == "lru":
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.mget(chunk)
+                self._index.touch(pipe, chunk)
+                values.extend(pipe.execute()[0])
+            elif self._cluster:
+                values.extend(self._redis.mget_nonatomic(chunk))
+            else:
+                values.extend(self._redis.mget(chunk))
+        values = [self._codec.decode(value) for value in values]
+        if fn:
+            values = [fn(value) for value in values]
+        return values
+
     def get_str(self, data: str) -> str:
         """
         automatically parametrizes Cache.get
         with the correct
         conversion function
         """
-        value = self._redis.get(data)
-        return value.decode('utf-8')
+        return _as_str(self._codec.decode(self._fetch(data)))
 
     def get_int(self, data: str) -> int:
         """
         automatically parametrizes Cache.get
         with the correct conversion function
         """
-        value = self._redis.get(data)
-        try:
-            value = int(value.decode("utf-8"))
-        except Exception:
-            value = 0
-        return value
+        return _as_int(self._codec.decode(self._fetch(data)))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Latency histograms for time_calls: log-bucketed
+counts aggregated in process and added up in one
+Redis hash per qualname, so the percentiles cover
+every process
+Usage: ./histogram.py [--namespace NAME] [qualname ...]
+"""
+from counters import CounterBuffer
+from pool import get_client
+import sys
+import threading
+import redis
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+SUB_BITS = 5  # 32 sub-buckets per power of two, within about 3%
+SUB = 1 << SUB_BITS
+PREFIX = "latency:"
+QUANTILES = (50, 90, 99, 99.9)
+
+
+def bucket_of(micros: int) -> int:
+    """
+    Return the bucket of a latency in microseconds,
+    exact below 64us and log-linear above
+    """
+    if micros < 2 * SUB:
+        return max(micros, 0)
+    shift = micros.bit_length() - SUB_BITS - 1
+    return shift * SUB + (micros >> shift)
+
+
+def bucket_range(bucket: int) -> Tuple[int, int]:
+    """
+    Return the lowest and highest latency,
+    in microseconds, a bucket counts
+    """
+    if bucket < 2 * SUB:
+        return bucket, bucket
+    shift = bucket // SUB - 1
+    mantissa = bucket - shift * SUB
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    Counts of latencies per bucket
+    """
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        """
+        Constructor method that starts from counts
+        """
+        self.counts: Dict[int, int] = dict(counts or {})
+
+    def record(self, seconds: float) -> None:
+        """
+        Count one latency
+        """
+        bucket = bucket_of(int(seconds * 1e6))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other: "Histogram") -> None:
+        """
+        Add the counts of another histogram
+        """
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    @property
+    def total(self) -> int:
+        """
+        Return the number of latencies counted
+        """
+        return sum(self.counts.values())
+
+    def percentile(self, percent: float) -> float:
+        """
+        Return the latency, in seconds, below which
+        percent of the counted latencies fall
+        """
+        total = self.total
+        if not total:
+            return 0.0
+        rank = max(1, -(-total * percent // 100))  # Ceiling
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                low, high = bucket_range(bucket)
+                return (low + high) / 2 / 1e6
+        return bucket_range(max(self.counts))[1] / 1e6
+
+
+class HistogramBuffer(CounterBuffer):
+    """
+    Pending bucket counts keyed by (qualname, bucket),
+    flushed with HINCRBY into <prefix><qualname>
+    """
+
+    def __init__(self, client: redis.Redis, interval: float = 1.0,
+                 batch: int = 1000, prefix: str = PREFIX):
+        """
+        Constructor method that takes the key prefix
+        of the histograms, latency: by default
+        """
+        self.prefix = prefix
+        super().__init__(client, interval, batch)
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Count one latency of a qualname
+        """
+        self.add((name, bucket_of(int(seconds * 1e6))))
+
+    def _command(self) -> Callable:
+        """
+        Return the function queuing the commands
+        adding one pending bucket count
+        """
+        prefix = self.prefix
+
+        def queue(pipe, key, amount: int) -> None:
+            """
+            Queue the HINCRBY of a bucket and
+            remember its qualname
+            """
+            name, bucket = key
+            pipe.hincrby(prefix + name, bucket, amount)
+            pipe.sadd(prefix + "names", name)
+
+        return queue
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def enable(client: Optional[redis.Redis] = None,
+           interval: float = 1.0) -> HistogramBuffer:
+    """
+    Start timing the plain functions decorated with
+    time_calls, into the buffer of the process.
+    Cache methods are timed with Cache(timed=True)
+    """
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = HistogramBuffer(client or get_client(), interval)
+    return _recorder
+
+
+def recorder() -> Optional[HistogramBuffer]:
+    """
+    Return the buffer of the process, None
+    until enable() was called
+    """
+    return _recorder
+
+
+def load(name: str, client: Optional[redis.Redis] = None,
+         prefix: str = PREFIX) -> Histogram:
+    """
+    Return the histogram of a qualname,
+    summed over every process that flushed
+    """
+    counts = (client or get_client()).hgetall(prefix + name)
+    return Histogram({int(bucket): int(count)
+                      for bucket, count in counts.items()})
+
+
+def names(client: Optional[redis.Redis] = None,
+          prefix: str = PREFIX) -> List[str]:
+    """
+    Return the qualnames that have a histogram
+    """
+    return sorted(name.decode("utf-8") for name in
+                  (client or get_client()).smembers(prefix + "names"))
+
+
+def percentiles(name: str, quantiles: Iterable[float] = QUANTILES,
+                client: Optional[redis.Redis] = None,
+                prefix: str = PREFIX) -> Dict[float, float]:
+    """
+    Return the latency percentiles of a qualname in seconds,
+    flushing the latencies of the process buffer first
+    """
+    if _recorder is not None and client is None and prefix == PREFIX:
+        _recorder.flush()
+    histogram = load(name, client, prefix)
+    return {quantile: histogram.percentile(quantile)
+            for quantile in quantiles}
+
+
+def report(qualnames: Optional[Iterable[str]] = None,
+           client: Optional[redis.Redis] = None,
+           prefix: str = PREFIX) -> None:
+    """
+    Print the count and p50, p90, p99 and p999
+    in milliseconds of every qualname
+    """
+    print("{:<30} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+        "qualname", "calls", "p50", "p90", "p99", "p999"))
+    for name in qualnames or names(client, prefix):
+        histogram = load(name, client, prefix)
+        print("{:<30} {:>10}".format(name, histogram.total) + "".join(
+            " {:>9.3f}".format(histogram.percentile(quantile) * 1e3)
+            for quantile in QUANTILES))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    prefix = PREFIX
+    if args[:1] == ["--namespace"] and len(args) > 1:
+        prefix = "{}:{}".format(args[1], PREFIX)
+        args = args[2:]
+    report(args, prefix=prefix)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Key strategies for Cache.store: how the key
+of every stored value is generated
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+import redis
+from typing import List, Optional, Union
+
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WIDTH_64 = 11  # base62 digits of the largest 64-bit value
+
+
+def base62(number: int, width: int = 0) -> str:
+    """
+    Return the base62 digits of a non-negative int,
+    left-padded with zeros to width, so that ids of
+    one width sort as their numbers do
+    """
+    digits = []
+    while number:
+        number, digit = divmod(number, 62)
+        digits.append(BASE62[digit])
+    return "".join(reversed(digits)).rjust(max(width, 1), BASE62[0])
+
+
+class KeyStrategy:
+    """
+    Generates the keys of stored values
+    """
+
+    def new_key(self) -> Union[str, bytes]:
+        """
+        Return a key no other call returns
+        """
+        raise NotImplementedError
+
+    def new_keys(self, n: int) -> List[Union[str, bytes]]:
+        """
+        Return n new keys
+        """
+        return [self.new_key() for _ in range(n)]
+
+
+class UUIDKeys(KeyStrategy):
+    """
+    The 36-character uuid4 text Cache always used
+    """
+
+    def new_key(self) -> str:
+        """
+        Return a random uuid4 as text
+        """
+        return str(uuid.uuid4())
+
+
+class BinaryUUIDKeys(KeyStrategy):
+    """
+    The 16 raw bytes of a uuid4
+    """
+
+    def new_key(self) -> bytes:
+        """
+        Return a random uuid4 as bytes
+        """
+        return uuid.uuid4().bytes
+
+
+# KEYS: the lease of a worker id
+# ARGV: token of the holder, ttl in seconds
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SnowflakeKeys(KeyStrategy):
+    """
+    Time-ordered base62 ids made locally from 41 bits
+    of milliseconds, 10 bits of worker id and 12 bits
+    of per-millisecond sequence, padded to 11
+    characters so they sort by time as text.
+    Two processes with the same worker id make the
+    same ids, so it must be unique among the writers:
+    either given, or leased from Redis with client
+    """
+
+    def __init__(self, worker_id: Optional[int] = None,
+                 client: Optional[redis.Redis] = None,
+                 lease: str = "Cache:workers", lease_ttl: int = 60):
+        """
+        Constructor method that takes a unique worker
+        id from 0 to 1023, or a client to lease one from,
+        held for lease_ttl seconds and renewed while used
+        """
+        if worker_id is None and client is None:
+            raise ValueError("SnowflakeKeys needs a unique worker_id, "
+                             "or a client to lease one from")
+        if worker_id is not None and not 0 <= worker_id <= 0x3FF:
+            raise ValueError("worker_id must be between 0 and 1023")
+        self._fixed_worker = worker_id
+        self._redis = client
+        self._lease = lease
+        self._lease_ttl = lease_ttl
+        self._renew = None
+        if worker_id is None:
+            self._renew = client.register_script(RENEW_SCRIPT)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        """
+        Take the worker id of the current process
+        """
+        self._pid = os.getpid()
+        if self._fixed_worker is not None:
+            self._worker = self._fixed_worker
+        else:
+            self._acquire()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _acquire(self) -> None:
+        """
+        Lease the next free worker id, claimed with
+        SET NX so no live process holds the same one
+        """
+        self._token = "{}:{}:{}".format(socket.gethostname(), os.getpid(),
+                                        uuid.uuid4().hex)
+        for _ in range(0x400):
+            worker = self._redis.incr(self._lease) & 0x3FF
+            if self._redis.set("{}:{}".format(self._lease, worker),
+                               self._token, nx=True, ex=self._lease_ttl):
+                self._worker = worker
+                self._renewed = time.monotonic()
+                return
+        raise RuntimeError("all 1024 worker ids are leased")
+
+    def _keep_lease(self) -> None:
+        """
+        Renew the lease once a third of it went by,
+        leasing a new worker id if it was lost
+        """
+        if time.monotonic() - self._renewed < self._lease_ttl / 3:
+            return
+        if self._renew(keys=["{}:{}".format(self._lease, self._worker)],
+                       args=[self._token, self._lease_ttl]):
+            self._renewed = time.monotonic()
+        else:
+            self._acquire()
+
+    def new_key(self) -> str:
+        """
+        Return the next id, waiting for the next
+        millisecond once 4096 were made in this one
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                if self._fixed_worker is not None:
+                    raise RuntimeError("a forked child cannot share the "
+                                       "worker_id of its parent")
+                self._reset()  # A forked child leases its own worker id
+            elif self._renew is not None:
+                self._keep_lease()
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now < self._last_ms:
+                now = self._last_ms  # Clock went back, keep ids ordered
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & 0xFFF
+                if self._sequence == 0:
+                    while now <= self._last_ms:
+                        now = int(time.time() * 1000) - EPOCH_MS
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return base62((now << 22) | (self._worker << 12) |
+                          self._sequence, WIDTH_64)
+
+
+class BlockKeys(KeyStrategy):
+    """
+    Sequential base62 ids handed out from blocks
+    reserved with one INCRBY on a shared counter.
+    A missing counter starts at the current time in
+    ms times 1024, so one reset by FLUSHDB cannot hand
+    out blocks again while fewer than a million ids
+    a second were reserved on average
+    """
+
+    def __init__(self, client: redis.Redis, counter: str = "Cache:ids",
+                 block: int = 1000):
+        """
+        Constructor method that names the counter
+        holding the last reserved id
+        """
+        self._redis = client
+        self._counter = counter
+        self._block = block
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next = self._end = 0
+
+    def _reserve(self, size: int) -> int:
+        """
+        Reserve size ids and return the end of the block,
+        seeding a missing counter in the same round trip
+        """
+        floor = (int(time.time() * 1000) - EPOCH_MS) << 10
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._counter, floor, nx=True)
+        pipe.incrby(self._counter, size)
+        return pipe.execute()[1] + 1
+
+    def new_key(self) -> str:
+        """
+        Return the next id of the current block,
+        reserving a new block when it is used up
+        """
+        return self.new_keys(1)[0]
+
+    def new_keys(self, n: int) -> List[str]:
+        """
+        Return n ids with at most one round trip
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Never reuse the block the parent is handing out
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            if self._end - self._next < n:
+                size = max(self._block, n)
+                self._end = self._reserve(size)
+                self._next = self._end - size
+            ids = range(self._next, self._next + n)
+            self._next += n
+        return [base62(i) for i in ids]
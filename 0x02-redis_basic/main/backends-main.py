@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Main file checking that MemoryBackend and TieredBackend
+answer the commands Cache sends the way Redis does
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+backends = __import__('backends')
+Cache = __import__('exercise').Cache
+
+
+def fails(command, *args, **kwargs) -> str:
+    """
+    Return the start of the error a command raises
+    """
+    try:
+        command(*args, **kwargs)
+    except redis.ResponseError as error:
+        return str(error).split()[0]
+    raise AssertionError("{} did not fail".format(command.__name__))
+
+
+def check(db) -> list:
+    """
+    Run the commands on db, asserting what Redis
+    does, and return every reply to compare them
+    """
+    db.flushdb()
+    replies = []
+    log = replies.append
+
+    # Strings, str and bytes naming the same key
+    log(db.set("s", "v"))
+    assert db.get(b"s") == b"v" and db.get("missing") is None
+    log(db.set("s", "w", nx=True))
+    log(db.mset({"a": 1, "b": 2.5, b"c": b"\x00\xff"}))
+    log(db.mget(["a", "b", "c", "missing"]))
+    log(db.mget("a", "b"))
+    log([db.incr("n"), db.incr("n", 5), db.incrby("n", -2)])
+    assert db.get("n") == b"4"
+    log(fails(db.incr, "b"))
+
+    # Lists
+    log(db.rpush("l", "x", "y", "z", 4))
+    log([db.lrange("l", 0, -1), db.lrange("l", -2, 100),
+         db.lrange("l", 2, 1), db.lrange("l", -100, 0),
+         db.lrange("missing", 0, -1)])
+    log(db.ltrim("l", -3, -1))
+    log(db.lrange("l", 0, -1))
+    log(db.ltrim("l", 5, 10))
+    assert db.exists("l") == 0  # An emptied list is removed
+    db.rpush("l", "x")
+    log([fails(db.get, "l"), fails(db.rpush, "s", "x")])
+
+    # Expiry
+    log(db.set("t", "v", px=100))
+    log(db.set("u", 5, ex=10))
+    log([db.ttl("u"), db.ttl("s"), db.ttl("missing")])
+    log(db.incr("u"))  # Keeps its expiry
+    assert db.ttl("u") == 10
+    time.sleep(0.15)
+    log([db.get("t"), db.exists("t", "u", "s")])
+
+    # Hashes and sets
+    log(db.hset("h", mapping={"a": 1, "b": 2}))
+    log(db.hset("h", "b", 3))
+    log([db.hget("h", "b"), db.hmget("h", ["a", "b", "c"]),
+         db.hgetall("h"), db.hincrby("h", "a", 10)])
+    log([db.hdel("h", "a", "b", "c"), db.exists("h")])
+    log([db.sadd("set", "a", "b", "a"), sorted(db.smembers("set")),
+         db.srem("set", "a", "z")])
+
+    # Keys
+    db.rename("u", "u2")
+    log([db.type("u2"), db.type("l"), db.type("set"), db.type("missing")])
+    assert db.ttl("u2") == 10
+    log(fails(db.rename, "missing", "x"))
+    db.mset({"ns*:1": 1, "ns*:2": 2, "nsx:1": 3})
+    log(sorted(db.scan_iter(match="ns\\*:*")))
+    log([db.unlink("ns*:1", "ns*:2", "missing"), db.exists("nsx:1")])
+
+    # Pipelines chain, and raise after running every command
+    pipe = db.pipeline(transaction=False)
+    pipe.set("p", 1).incr("p").get("p")
+    log(pipe.execute())
+    pipe = db.pipeline()
+    pipe.incr("l")
+    pipe.set("after", 1)
+    log(fails(pipe.execute))
+    log(db.get("after"))
+    return replies
+
+
+expected = check(backends.RedisBackend())
+for name in ("MemoryBackend", "TieredBackend"):
+    replies = check(getattr(backends, name)())
+    for i, (got, want) in enumerate(zip(replies, expected)):
+        assert got == want, "{} reply {}: {!r} != {!r}".format(
+            name, i, got, want)
+    print(name, "matches Redis on", len(replies), "replies")
+
+# max_keys only drops stored values, never counts or history
+cache = Cache(backend=backends.MemoryBackend(max_keys=10))
+keys = [cache.store(i) for i in range(50)]
+print(cache.get_int(keys[-1]), cache.get(keys[0]),
+      cache.get(cache.store.__qualname__),
+      len(cache._redis.lrange(cache.store.__qualname__ + ":inputs", 0, -1)))
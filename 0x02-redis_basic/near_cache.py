@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+A bounded in-process cache in front of Redis
+reads, kept coherent by server-assisted client
+side caching (CLIENT TRACKING) or, on servers
+older than 6.0, by a pub/sub invalidation channel
+"""
+from collections import OrderedDict
+from pool import ConnectionPool, limits
+import redis
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+ENTRY_OVERHEAD = 64  # Rough bookkeeping cost of one entry, in bytes
+
+
+def _as_bytes(key) -> bytes:
+    """
+    Normalize a key the way Redis reports it
+    """
+    return key.encode("utf-8") if isinstance(key, str) else bytes(key)
+
+
+class LRU:
+    """
+    A thread-safe least-recently-used map
+    capped by the total size of its entries
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Constructor method that sets the size cap
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}  # Keys being fetched, mapped to their token
+        self._lock = threading.Lock()
+
+    def lookup(self, key: bytes) -> Tuple[bool, Optional[bytes]]:
+        """
+        Return (found, value) and count the hit or miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def reserve(self, key: bytes) -> object:
+        """
+        Mark a key as being fetched, an invalidation
+        arriving before fill() cancels the reservation
+        """
+        token = object()
+        with self._lock:
+            self._pending[key] = token
+        return token
+
+    def fill(self, key: bytes, token: object,
+             value: Optional[bytes]) -> None:
+        """
+        Insert a fetched value if its reservation still holds
+        """
+        cost = len(key) + len(value or b"") + ENTRY_OVERHEAD
+        with self._lock:
+            if self._pending.get(key) is not token:
+                return
+            del self._pending[key]
+            if cost > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self.size += cost
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, keys: Iterable[bytes]) -> None:
+        """
+        Drop keys and cancel their pending reservations
+        """
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self) -> None:
+        """
+        Drop every entry and reservation
+        """
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self.size = 0
+
+    def _remove(self, key: bytes) -> None:
+        """
+        Remove an entry, the lock must be held
+        """
+        value = self._entries.pop(key)
+        self.size -= len(key) + len(value or b"") + ENTRY_OVERHEAD
+
+
+class NearCache:
+    """
+    Serve repeated GETs from an LRU, reading misses
+    through connections tracked by the server so that
+    writes from any client invalidate the local copy
+    """
+
+    def __init__(self, max_bytes: int,
+                 max_connections: Optional[int] = None,
+                 timeout: Optional[float] = None, **connection_kwargs):
+        """
+        Constructor method that starts the invalidation
+        listener for the server in connection_kwargs.
+        Reads go through a blocking pool bounded like
+        those of pool.py, with their configured limits
+        unless max_connections or timeout are given
+        """
+        self.lru = LRU(max_bytes)
+        self.tracking = None  # Decided by the listener on connect
+        self._redirect = None
+        self._ready = threading.Event()
+        self._closed = threading.Event()
+        self._connection_kwargs = connection_kwargs
+        options = limits()
+        if max_connections is not None:
+            options["max_connections"] = max_connections
+        if timeout is not None:
+            options["timeout"] = timeout
+        pool = _TrackingPool(self, redis_connect_func=self._on_connect,
+                             **options, **connection_kwargs)
+        self._redis = redis.Redis(connection_pool=pool)
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def get(self, key) -> Optional[bytes]:
+        """
+        Return the raw value of a key
+        """
+        if not self._ready.is_set():
+            return self._redis.get(key)
+        name = _as_bytes(key)
+        found, value = self.lru.lookup(name)
+        if found:
+            return value
+        token = self.lru.reserve(name)
+        value = self._redis.get(key)
+        self.lru.fill(name, token, value)
+        return value
+
+    def mget(self, keys: List) -> List[Optional[bytes]]:
+        """
+        Return the raw values of many keys,
+        fetching only the misses with one MGET
+        """
+        if not self._ready.is_set():
+            return self._redis.mget(keys)
+        values = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            found, values[i] = self.lru.lookup(_as_bytes(key))
+            if not found:
+                missing.append(i)
+        if missing:
+            tokens = [self.lru.reserve(_as_bytes(keys[i])) for i in missing]
+            fetched = self._redis.mget([keys[i] for i in missing])
+            for i, token, value in zip(missing, tokens, fetched):
+                self.lru.fill(_as_bytes(keys[i]), token, value)
+                values[i] = value
+        return values
+
+    def publish(self, client: redis.Redis, keys: Iterable) -> None:
+        """
+        Announce overwritten or deleted keys, needed
+        only in the pub/sub fallback mode
+        """
+        keys = [_as_bytes(key) for key in keys]
+        self.lru.invalidate(keys)
+        if self.tracking is False:
+            for key in keys:
+                client.publish(INVALIDATE_CHANNEL, key)
+
+    def stats(self) -> dict:
+        """
+        Return the hit and miss counters, the size
+        and the usage of the connection pool
+        """
+        return {
+            "hits": self.lru.hits,
+            "misses": self.lru.misses,
+            "entries": len(self.lru._entries),
+            "bytes": self.lru.size,
+            "max_bytes": self.lru.max_bytes,
+            "tracking": self.tracking,
+            "pool": self._redis.connection_pool.stats(),
+        }
+
+    def close(self) -> None:
+        """
+        Stop the listener and drop every entry
+        """
+        self._closed.set()
+        self._listener.join()
+        self._redis.connection_pool.disconnect()
+        self.lru.clear()
+
+    def _on_connect(self, connection: redis.Connection) -> None:
+        """
+        Turn tracking on for a reading connection,
+        redirecting invalidations to the listener
+        """
+        connection.on_connect()
+        connection.redirect = self._redirect
+        if self.tracking and self._redirect is not None:
+            connection.send_command("CLIENT", "TRACKING", "ON",
+                                    "REDIRECT", self._redirect)
+            connection.read_response()
+
+    def _listen(self) -> None:
+        """
+        Receive invalidation messages, reconnecting
+        and emptying the LRU whenever the link drops
+        """
+        while not self._closed.is_set():
+            conn = redis.Connection(**self._connection_kwargs)
+            try:
+                conn.connect()
+                conn.send_command("INFO", "server")
+                info = conn.read_response().decode("utf-8")
+                version = info.split("redis_version:")[1].split(".")[0]
+                self.tracking = int(version) >= 6
+                conn.send_command("CLIENT", "ID")
+                self._redirect = conn.read_response()
+                conn.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+                conn.read_response()
+                self._ready.set()
+                while not self._closed.is_set():
+                    if conn.can_read(timeout=0.5):
+                        self._on_message(conn.read_response())
+            except (redis.ConnectionError, redis.TimeoutError, OSError):
+                pass
+            finally:
+                self._ready.clear()
+                self.lru.clear()
+                conn.disconnect()
+            self._closed.wait(1)
+
+    def _on_message(self, message: list) -> None:
+        """
+        Apply one invalidation message, a nil
+        payload means the database was flushed
+        """
+        if message[0] != b"message":
+            return
+        keys = message[2]
+        if keys is None:
+            self.lru.clear()
+        elif isinstance(keys, list):
+            self.lru.invalidate(keys)
+        else:
+            self.lru.invalidate([keys])
+
+
+class _TrackingPool(ConnectionPool):
+    """
+    A bounded pool that reconnects connections set
+    up for an older listener before handing them out
+    """
+
+    def __init__(self, near_cache: NearCache, **kwargs):
+        """
+        Constructor method that keeps the owning near cache
+        """
+        super().__init__(**kwargs)
+        self._near_cache = near_cache
+
+    def get_connection(self, command_name, *keys, **options):
+        """
+        Check a connection out, refreshing its redirect
+        """
+        connection = super().get_connection(command_name, *keys, **options)
+        if getattr(connection, "redirect", None) != \
+                self._near_cache._redirect:
+            connection.disconnect()
+            connection.connect()
+        return connection
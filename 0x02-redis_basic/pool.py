@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+A process-wide registry of blocking Redis
+connection pools, shared by Cache, replay
+and web.get_page
+"""
+import os
+import threading
+import redis
+from typing import Dict, Optional
+
+
+# Defaults for pools created after configure() is called
+_defaults = {"max_connections": 50, "timeout": 20,
+             "host": "localhost", "port": 6379, "db": 0}
+
+_pools: Dict[tuple, "ConnectionPool"] = {}
+_clusters: Dict[tuple, redis.RedisCluster] = {}
+_lock = threading.Lock()
+
+
+class ConnectionPool(redis.BlockingConnectionPool):
+    """
+    A bounded connection pool whose checkouts block
+    for up to timeout seconds, counting how many of
+    them had to wait for a free connection
+    """
+
+    def reset(self):
+        """
+        Empty the pool and its statistics, redis-py
+        also calls this in a forked child
+        """
+        super().reset()
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        """
+        Check a connection out, blocking while
+        every connection is in use
+        """
+        with self._stats_lock:
+            self.checkouts += 1
+            if self.pool.empty():
+                self.waits += 1
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            if self.pool.empty():
+                with self._stats_lock:
+                    self.timeouts += 1
+            raise
+
+    def stats(self) -> dict:
+        """
+        Return the size and usage counters of the pool
+        """
+        idle = sum(1 for conn in list(self.pool.queue) if conn is not None)
+        created = len(self._connections)
+        return {
+            "max_connections": self.max_connections,
+            "created": created,
+            "in_use": created - idle,
+            "idle": idle,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+        }
+
+
+def configure(max_connections: Optional[int] = None,
+              timeout: Optional[float] = None, **connection_kwargs) -> None:
+    """
+    Set the size and checkout timeout used by pools
+    created from now on, and the default endpoint or
+    connection options such as host, port or db
+    """
+    if max_connections is not None:
+        _defaults["max_connections"] = max_connections
+    if timeout is not None:
+        _defaults["timeout"] = timeout
+    _defaults.update(connection_kwargs)
+
+
+def limits() -> dict:
+    """
+    Return the max_connections and timeout
+    that pools are created with
+    """
+    return {"max_connections": _defaults["max_connections"],
+            "timeout": _defaults["timeout"]}
+
+
+def get_pool(host: Optional[str] = None, port: Optional[int] = None,
+             db: Optional[int] = None, **kwargs) -> ConnectionPool:
+    """
+    Return the shared pool for an endpoint, creating
+    it on first use. max_connections and timeout only
+    apply to the call that creates the pool
+    """
+    options = dict(_defaults)
+    options.update(kwargs)
+    max_connections = options.pop("max_connections")
+    timeout = options.pop("timeout")
+    # Explicit arguments win over the configured endpoint
+    endpoint = {"host": host, "port": port, "db": db}
+    for name in endpoint:
+        default = options.pop(name)
+        if endpoint[name] is None:
+            endpoint[name] = default
+    host, port, db = endpoint["host"], endpoint["port"], endpoint["db"]
+    key = (host, port, db, tuple(sorted(options.items())))
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(host=host, port=port, db=db,
+                                  max_connections=max_connections,
+                                  timeout=timeout, **options)
+            _pools[key] = pool
+    return pool
+
+
+def get_client(**kwargs) -> redis.Redis:
+    """
+    Return a Redis client backed by the shared pool
+    """
+    return redis.Redis(connection_pool=get_pool(**kwargs))
+
+
+def get_cluster(host: str = "localhost", port: int = 7000,
+                **kwargs) -> redis.RedisCluster:
+    """
+    Return the shared Redis Cluster client reached
+    through a node, it keeps one pool per node and
+    routes every command to the node of its slot
+    """
+    key = (host, port, tuple(sorted(kwargs.items())))
+    with _lock:
+        client = _clusters.get(key)
+        if client is None:
+            kwargs.setdefault("max_connections",
+                              _defaults["max_connections"])
+            client = redis.RedisCluster(host=host, port=port, **kwargs)
+            _clusters[key] = client
+    return client
+
+
+def pool_stats() -> Dict[str, dict]:
+    """
+    Return the statistics of every pool
+    keyed by host:port/db
+    """
+    with _lock:
+        pools = dict(_pools)
+    return {"{}:{}/{}".format(*key[:3]): pool.stats()
+            for key, pool in pools.items()}
+
+
+def _after_fork_in_child():
+    """
+    Sockets belong to the parent, so the child
+    starts every pool afresh, and builds new cluster
+    clients once the node pools of the inherited
+    ones are reset
+    """
+    global _lock
+    _lock = threading.Lock()
+    for pool in _pools.values():
+        pool.reset()
+    for client in _clusters.values():
+        for node in client.get_nodes():
+            if node.redis_connection is not None:
+                node.redis_connection.connection_pool.reset()
+    _clusters.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
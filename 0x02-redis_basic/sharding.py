@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Client-side sharding of Cache across several
+Redis servers with a consistent-hash ring
+"""
+from bisect import bisect
+from codec import Codec
+from concurrent.futures import ThreadPoolExecutor
+from backends import RedisBackend
+from exercise import (Cache, _data_key, _log_calls, _meta_key, _sampled,
+                      _scan_pattern, call_history, count_calls, time_calls)
+import hashlib
+import histogram
+from itertools import islice
+from keys import KeyStrategy
+from pool import get_client
+from snapshots import MAGIC, live_batches, queue_restores, write_snapshot
+import time
+from typing import (Callable, Dict, Iterable, List, Optional, Sequence,
+                    Union)
+
+
+def _hash(key: Union[str, bytes]) -> int:
+    """
+    Return the 64-bit position of a key on the ring
+    """
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          "big")
+
+
+class HashRing:
+    """
+    A consistent-hash ring giving every node replicas
+    virtual points, so adding or removing one of N
+    nodes moves only about 1/N of the keys
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 160):
+        """
+        Constructor method that places the nodes
+        """
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        """
+        Place the virtual points of a node
+        """
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        self._place()
+
+    def remove(self, node: str) -> None:
+        """
+        Take the virtual points of a node away
+        """
+        self.nodes.remove(node)
+        self._place()
+
+    def _place(self) -> None:
+        """
+        Rebuild the sorted points of every node
+        """
+        points = sorted((_hash("{}#{}".format(node, i)), node)
+                        for node in self.nodes
+                        for i in range(self.replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: Union[str, bytes]) -> str:
+        """
+        Return the node owning a key, the first
+        point clockwise from its hash
+        """
+        if not self._points:
+            raise LookupError("the ring has no nodes")
+        i = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[i]
+
+    def group(self, keys: Sequence) -> Dict[str, List[int]]:
+        """
+        Return the positions of keys grouped by node
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.node_for(key), []).append(i)
+        return groups
+
+
+def _endpoint(node: str) -> dict:
+    """
+    Return the connection arguments of host:port[/db]
+    """
+    address, _, db = node.partition("/")
+    host, _, port = address.rpartition(":")
+    return {"host": host or "localhost", "port": int(port),
+            "db": int(db or 0)}
+
+
+class ShardedCache(Cache):
+    """
+    A Cache spreading its values over several Redis
+    servers. Batches are split by shard and sent to
+    every shard at once. Call counts, history and
+    latencies live on the first node, and eviction,
+    the near cache, buckets and dedup are not available
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 160,
+                 codec: Optional[Codec] = None,
+                 history: str = "lists",
+                 history_limit: Optional[int] = None,
+                 history_sample: int = 1,
+                 count_interval: Optional[float] = None,
+                 count_batch: int = 1000,
+                 keys: Optional[KeyStrategy] = None,
+                 namespace: Optional[str] = None,
+                 timed: bool = False,
+                 workers: Optional[int] = None):
+        """
+        Constructor method that connects to every
+        host:port[/db] in nodes. Unless a namespace
+        is given every node is flushed, as Cache does.
+        workers bounds the shards contacted at once
+        """
+        self.ring = HashRing(nodes, replicas)
+        self._clients = {node: get_client(**_endpoint(node))
+                         for node in nodes}
+        super().__init__(codec=codec, history=history,
+                         history_limit=history_limit,
+                         history_sample=history_sample,
+                         count_interval=count_interval,
+                         count_batch=count_batch, keys=keys,
+                         namespace=namespace, timed=timed,
+                         backend=RedisBackend(self._clients[nodes[0]]))
+        if namespace is None:
+            for client in self._clients.values():
+                client.flushdb()
+        self._executor = ThreadPoolExecutor(workers or len(nodes))
+
+    def add_node(self, node: str) -> None:
+        """
+        Add a server to the ring, the keys that move
+        to it read as missing until stored again
+        """
+        self._clients.setdefault(node, get_client(**_endpoint(node)))
+        self.ring.add(node)
+
+    def _client_for(self, key: Union[str, bytes]):
+        """
+        Return the client of the shard owning a key
+        """
+        return self._clients[self.ring.node_for(key)]
+
+    def _fan_out(self, keys: Sequence,
+                 send: Callable[[object, List[int]], list],
+                 groups: Optional[Dict[str, List[int]]] = None) -> list:
+        """
+        Call send(client, positions) for every shard
+        in parallel, and return the values it returned
+        put back at their positions in keys. groups
+        overrides the positions the ring gives each node
+        """
+        if groups is None:
+            groups = self.ring.group(keys)
+        futures = {self._executor.submit(send, self._clients[node], group):
+                   group for node, group in groups.items()}
+        values = [None] * len(keys)
+        for future, group in futures.items():
+            for i, value in zip(group, future.result()):
+                values[i] = value
+        return values
+
+    def _fetch(self, key: str) -> Optional[bytes]:
+        """
+        Return the raw value of a key from its shard
+        """
+        return self._client_for(key).get(key)
+
+    @time_calls
+    @count_calls
+    @call_history
+    def store(self, data: Union[str, bytes, int, float],
+              ttl: Optional[int] = None) -> Union[str, bytes]:
+        """
+        Method that takes a data argument
+        and returns a key, expiring after
+        ttl seconds when it is given
+        """
+        random_key = _data_key(self, self._keys.new_key())
+        self._client_for(random_key).set(random_key,
+                                         self._codec.encode(data), ex=ttl)
+        return random_key
+
+    def store_many(self,
+                   values: Iterable[Union[str, bytes, int, float]],
+                   ttl: Optional[int] = None,
+                   chunk_size: int = 1000) -> List[Union[str, bytes]]:
+        """
+        Store many values with one pipeline per shard
+        and chunk, all shards at once, and return their
+        keys in input order. Counted and logged as if
+        store had been called once per value
+        """
+        values = iter(values)
+        keys = []
+        qualname = _meta_key(self, self.store.__qualname__)
+        while True:
+            chunk = list(islice(values, chunk_size))
+            if not chunk:
+                break
+            start = time.perf_counter()
+            chunk_keys = [_data_key(self, key)
+                          for key in self._keys.new_keys(len(chunk))]
+            encoded = [self._codec.encode(value) for value in chunk]
+
+            def send(client, group: List[int]) -> list:
+                """
+                Write the values of one shard
+                """
+                pipe = client.pipeline(transaction=False)
+                if ttl is None:
+                    pipe.mset({chunk_keys[i]: encoded[i] for i in group})
+                else:
+                    for i in group:
+                        pipe.set(chunk_keys[i], encoded[i], ex=ttl)
+                pipe.execute()
+                return []
+
+            self._fan_out(chunk_keys, send)
+            logged = [i for i in range(len(chunk)) if _sampled(self)]
+            pipe = self._redis.pipeline(transaction=False)
+            if self._counter_buffer is not None:
+                self._counter_buffer.add(qualname, len(chunk))
+            else:
+                pipe.incrby(qualname, len(chunk))
+            if logged:
+                duration = (time.perf_counter() - start) / len(chunk)
+                _log_calls(self, pipe, qualname,
+                           [str((chunk[i],)) for i in logged],
+                           [str(chunk_keys[i]) for i in logged],
+                           [duration] * len(logged))
+            pipe.execute()
+            keys.extend(chunk_keys)
+        return keys
+
+    def get_many(self,
+                 keys: Iterable[str],
+                 fn: Optional[Callable] = None,
+                 chunk_size: int = 1000) -> List:
+        """
+        Fetch many keys with one MGET per shard and
+        chunk, all shards at once, and return the
+        values in input order, converted with fn
+        when it is given
+        """
+        keys = iter(keys)
+        values = []
+        while True:
+            chunk = list(islice(keys, chunk_size))
+            if not chunk:
+                break
+            values.extend(self._fan_out(
+                chunk, lambda client, group: client.mget(
+                    [chunk[i] for i in group])))
+        values = [self._codec.decode(value) for value in values]
+        if fn:
+            values = [fn(value) for value in values]
+        return values
+
+    def clear(self, batch: int = 1000) -> int:
+        """
+        Remove the namespace from every shard,
+        or flush every shard without a namespace
+        """
+        self.flush_counts()
+        if self._recorder is not None:
+            self._recorder.flush()
+        if self._namespace is None:
+            for client in self._clients.values():
+                client.flushdb()
+            return 0
+        removed = 0
+        for client in self._clients.values():
+            keys = client.scan_iter(match=_scan_pattern(self._namespace),
+                                    count=batch)
+            while True:
+                chunk = list(islice(keys, batch))
+                if not chunk:
+                    break
+                removed += client.unlink(*chunk)
+        return removed
+
+    def _is_meta(self, key: bytes) -> bool:
+        """
+        Tell whether a key is a counter, history or
+        histogram, which live on the first node
+        """
+        prefixes = (_meta_key(self, self.store.__qualname__),
+                    _meta_key(self, histogram.PREFIX))
+        return key.decode("utf-8", "replace").startswith(prefixes)
+
+    def export(self, fileobj, batch: int = 1000) -> int:
+        """
+        Write a snapshot of the namespace on every
+        shard, or of every whole database without
+        one, to a binary file. Returns the number
+        of keys written
+        """
+        self.flush_counts()
+        if self._recorder is not None:
+            self._recorder.flush()
+        pattern = "*" if self._namespace is None \
+            else _scan_pattern(self._namespace)
+        fileobj.write(MAGIC)
+        return sum(write_snapshot(client, pattern, fileobj, batch,
+                                  header=False)
+                   for client in self._clients.values())
+
+    def restore(self, fileobj, batch: int = 1000,
+                replace: bool = True) -> int:
+        """
+        Load a snapshot written by export, sending
+        every key to the shard the ring gives it and
+        the counters and history to the first node,
+        all shards at once. Returns the number of
+        keys restored
+        """
+        first = self.ring.nodes[0]
+        restored = 0
+        for live in live_batches(fileobj, batch):
+            keys = [key for key, _, _ in live]
+            groups: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                node = first if self._is_meta(key) \
+                    else self.ring.node_for(key)
+                groups.setdefault(node, []).append(i)
+
+            def send(client, group: List[int]) -> list:
+                """
+                Restore the keys of one shard
+                """
+                pipe = client.pipeline(transaction=False)
+                queue_restores(pipe, [live[i] for i in group], replace)
+                return pipe.execute()
+
+            self._fan_out(keys, send, groups)
+            restored += len(live)
+        return restored
+
+    def close(self) -> None:
+        """
+        Stop the fan-out threads and those of Cache
+        """
+        super().close()
+        self._executor.shutdown()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Snapshots of a set of keys: export streams their
+DUMP payloads and expiries to a binary file, and
+restore writes them back with pipelined RESTOREs
+"""
+import struct
+import time
+import redis
+from itertools import islice
+from typing import Callable, Iterator, Optional, Tuple
+
+MAGIC = b"RSNAP\x00\x01\n"
+# Key length, absolute expiry in unix ms (0 for none), payload length
+RECORD = struct.Struct(">IqI")
+
+
+def _read_exact(fileobj, size: int) -> bytes:
+    """
+    Read exactly size bytes, failing on a truncated file
+    """
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("truncated snapshot")
+    return data
+
+
+def records(fileobj) -> Iterator[Tuple[bytes, int, bytes]]:
+    """
+    Yield the (key, expiry, payload) records of a
+    snapshot one at a time, expiry being unix ms
+    or 0 for a key without one
+    """
+    if fileobj.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a snapshot file")
+    while True:
+        header = fileobj.read(RECORD.size)
+        if not header:
+            return
+        if len(header) != RECORD.size:
+            raise ValueError("truncated snapshot")
+        key_size, expiry, payload_size = RECORD.unpack(header)
+        key = _read_exact(fileobj, key_size)
+        yield key, expiry, _read_exact(fileobj, payload_size)
+
+
+def write_snapshot(client: redis.Redis, pattern: str, fileobj,
+                   batch: int = 1000, header: bool = True) -> int:
+    """
+    Write the keys matching pattern to a binary file,
+    SCANning batch keys at a time and reading their
+    PTTL and DUMP in one pipelined round trip, so only
+    one batch is ever in memory. Expiries are stored
+    as absolute times so a later restore keeps them.
+    Without header the records are appended to a
+    snapshot already started. Returns the number of
+    keys written
+    """
+    if header:
+        fileobj.write(MAGIC)
+    written = 0
+    keys = client.scan_iter(match=pattern, count=batch)
+    while True:
+        chunk = list(islice(keys, batch))
+        if not chunk:
+            return written
+        pipe = client.pipeline(transaction=False)
+        for key in chunk:
+            pipe.pttl(key)
+            pipe.dump(key)
+        results = pipe.execute()
+        now = int(time.time() * 1000)
+        for key, pttl, payload in zip(chunk, results[::2], results[1::2]):
+            if payload is None:
+                continue  # Expired or removed since the SCAN
+            # PTTL is -1 without an expiry, 0 for one under 1 ms away
+            expiry = now + pttl if pttl >= 0 else 0
+            fileobj.write(RECORD.pack(len(key), expiry, len(payload)))
+            fileobj.write(key)
+            fileobj.write(payload)
+            written += 1
+
+
+def live_batches(fileobj, batch: int = 1000) -> Iterator[list]:
+    """
+    Yield the records of a snapshot batch at a time,
+    without those that expired since the export
+    """
+    entries = records(fileobj)
+    while True:
+        chunk = list(islice(entries, batch))
+        if not chunk:
+            return
+        now = int(time.time() * 1000)
+        yield [entry for entry in chunk if not entry[1] or entry[1] > now]
+
+
+def restore_snapshot(client: redis.Redis, fileobj, batch: int = 1000,
+                     replace: bool = True,
+                     on_batch: Optional[Callable[[list], None]] = None) -> int:
+    """
+    RESTORE the keys of a snapshot file, batch keys
+    per pipelined round trip, with their original
+    expiry. Keys that expired since the export are
+    skipped, and existing keys are overwritten unless
+    replace is False, which raises on the first one.
+    on_batch is called with the keys of each batch.
+    Returns the number of keys restored
+    """
+    restored = 0
+    for live in live_batches(fileobj, batch):
+        pipe = client.pipeline(transaction=False)
+        queue_restores(pipe, live, replace)
+        pipe.execute()
+        restored += len(live)
+        if on_batch is not None and live:
+            on_batch([key for key, _, _ in live])
+    return restored
+
+
+def queue_restores(pipe, entries: list, replace: bool = True) -> None:
+    """
+    Queue the RESTORE of snapshot records on a pipeline
+    """
+    for key, expiry, payload in entries:
+        pipe.restore(key, expiry, payload, replace=replace,
+                     absttl=bool(expiry))
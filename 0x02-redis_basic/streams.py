@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Chunked storage of very large values: a value is
+written chunk by chunk into the fields of one hash
+and read back lazily through a file-like object
+"""
+import io
+import redis
+from typing import Optional, Union
+
+
+SIZE = b"size"
+CHUNK_SIZE = b"chunk_size"
+
+
+def _suffixed(key: Union[str, bytes], suffix: str) -> Union[str, bytes]:
+    """
+    Return key with a suffix, keeping its str or bytes type
+    """
+    if isinstance(key, bytes):
+        return key + suffix.encode("ascii")
+    return key + suffix
+
+
+def hash_tagged(key: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+    """
+    Return key wrapped in a cluster hash tag, so any
+    suffixed name shares its slot, or None when it
+    holds a brace and cannot be a tag by itself
+    """
+    if isinstance(key, bytes):
+        if b"{" in key or b"}" in key:
+            return None
+        return b"{" + key + b"}"
+    if "{" in key or "}" in key:
+        return None
+    return "{" + key + "}"
+
+
+def _fill(fileobj, view: memoryview) -> int:
+    """
+    Read from fileobj into view until it is full
+    or the file ends, and return the bytes read
+    """
+    readinto = getattr(fileobj, "readinto", None)
+    filled = 0
+    while filled < len(view):
+        if readinto is not None:
+            n = readinto(view[filled:])
+        else:
+            data = fileobj.read(len(view) - filled)
+            n = len(data)
+            view[filled:filled + n] = data
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def write_stream(client: redis.Redis, key: Union[str, bytes], fileobj,
+                 chunk_size: int, window: int = 8,
+                 ttl: Optional[int] = None) -> int:
+    """
+    Copy fileobj into the hash key, one HSET per chunk
+    and one pipeline per window chunks, and return its
+    size. Chunks are sent as memoryview slices of one
+    reused buffer, and the hash only appears under key
+    once complete. On a cluster key must carry a hash
+    tag so key:partial shares its slot, and the RENAME
+    goes outside the pipeline, which cannot send it
+    """
+    partial = _suffixed(key, ":partial")
+    buffer = bytearray(chunk_size * window)
+    view = memoryview(buffer)
+    client.unlink(partial)
+    size = index = 0
+    done = False
+    while not done:
+        filled = _fill(fileobj, view)
+        done = filled < len(view)
+        pipe = client.pipeline(transaction=False)
+        for start in range(0, filled, chunk_size):
+            chunk = view[start:min(start + chunk_size, filled)]
+            pipe.hset(partial, index, chunk)
+            index += 1
+        size += filled
+        if done:
+            pipe.hset(partial, mapping={SIZE: size, CHUNK_SIZE: chunk_size})
+            if ttl is not None:
+                pipe.expire(partial, ttl)
+        pipe.execute()  # The buffer is only reused once sent
+    client.rename(partial, key)
+    return size
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    A read-only, seekable file over a chunked value,
+    fetching window chunks per pipelined round trip
+    """
+
+    def __init__(self, client: redis.Redis, key: Union[str, bytes],
+                 size: int, chunk_size: int, window: int = 8):
+        """
+        Constructor method that takes the manifest
+        """
+        super().__init__()
+        self._redis = client
+        self._key = key
+        self.size = size
+        self.chunk_size = chunk_size
+        self.window = window
+        self._position = 0
+        self._chunks = {}  # Index -> bytes of the current window
+
+    @classmethod
+    def open(cls, client: redis.Redis, key: Union[str, bytes],
+             window: int = 8) -> Optional["ChunkReader"]:
+        """
+        Return a reader for key, None if it is missing
+        """
+        size, chunk_size = client.hmget(key, SIZE, CHUNK_SIZE)
+        if size is None:
+            return None
+        return cls(client, key, int(size), int(chunk_size), window)
+
+    def readable(self) -> bool:
+        """
+        Tell that the file can be read
+        """
+        return True
+
+    def seekable(self) -> bool:
+        """
+        Tell that the file can be positioned
+        """
+        return True
+
+    def tell(self) -> int:
+        """
+        Return the current position
+        """
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """
+        Move the position, as file.seek does
+        """
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def _chunk(self, index: int) -> memoryview:
+        """
+        Return a chunk, fetching it and the
+        following ones when it is not loaded
+        """
+        if index not in self._chunks:
+            last = min(index + self.window,
+                       -(-self.size // self.chunk_size))
+            pipe = self._redis.pipeline(transaction=False)
+            for i in range(index, last):
+                pipe.hget(self._key, i)
+            chunks = pipe.execute()
+            if any(chunk is None for chunk in chunks):
+                raise OSError("the value was removed while reading")
+            self._chunks = dict(zip(range(index, last), chunks))
+        return memoryview(self._chunks[index])
+
+    def readinto(self, buffer) -> int:
+        """
+        Copy the next bytes into buffer and
+        return how many there were
+        """
+        view = memoryview(buffer).cast("B")
+        end = min(self._position + len(view), self.size)
+        copied = 0
+        while self._position < end:
+            index, offset = divmod(self._position, self.chunk_size)
+            chunk = self._chunk(index)[offset:offset + end - self._position]
+            view[copied:copied + len(chunk)] = chunk
+            copied += len(chunk)
+            self._position += len(chunk)
+        return copied
+
+    def readall(self) -> bytes:
+        """
+        Return the rest of the value
+        """
+        parts = []
+        while self._position < self.size:
+            index, offset = divmod(self._position, self.chunk_size)
+            parts.append(self._chunk(index)[offset:])
+            self._position += len(parts[-1])
+        return b"".join(parts)
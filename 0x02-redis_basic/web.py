@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 """ expiring web cache module """
 
-import redis
 import requests
 from typing import Callable
 from functools import wraps
-
-redis = redis.Redis()
+from exercise import time_calls
+from pool import get_client
 
 
 def wrap_requests(fn: Callable) -> Callable:
@@ -15,6 +14,7 @@ def wrap_requests(fn: Callable) -> Callable:
     @wraps(fn)
     def wrapper(url):
         """ Wrapper for decorator guy """
+        redis = get_client()
         redis.incr(f"count:{url}")
         cached_response = redis.get(f"cached:{url}")
         if cached_response:
@@ -26,6 +26,7 @@ def wrap_requests(fn: Callable) -> Callable:
     return wrapper
 
 
+@time_calls
 @wrap_requests
 def get_page(url: str) -> str:
     """get page self descriptive